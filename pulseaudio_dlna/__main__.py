@@ -18,17 +18,20 @@
 '''
 Usage:
     pulseaudio-dlna [--host <host>] [--port <port>][--encoder <encoders> | --codec <codec>] [--bit-rate=<rate>]
-                    [--encoder-backend <encoder-backend>]
+                    [--encoder-backend <encoder-backend>] [--latency <profile>]
+                    [--recorder <recorder>] [--capture-latency <msec>] [--fragment-size <bytes>]
                     [--filter-device=<filter-device>]
                     [--renderer-urls <urls>]
-                    [--request-timeout <timeout>]
-                    [--chunk-size <chunk-size>]
+                    [--request-timeout <timeout>] [--server-mode <mode>]
+                    [--chunk-size <chunk-size>] [--buffer-policy <policy>] [--buffer-size <seconds>]
+                    [--suspend-on-silence <seconds>] [--range-buffer <seconds>]
                     [--msearch-port=<msearch-port>] [--ssdp-mx <ssdp-mx>] [--ssdp-ttl <ssdp-ttl>] [--ssdp-amount <ssdp-amount>]
                     [--cover-mode <mode>]
-                    [--auto-reconnect]
+                    [--auto-reconnect] [--passthrough] [--prewarm] [--latency-probe]
                     [--debug]
                     [--fake-http10-content-length] [--fake-http-content-length]
                     [--disable-switchback] [--disable-ssdp-listener] [--disable-device-stop] [--disable-workarounds] [--disable-mimetype-check]
+                    [--disable-splice]
     pulseaudio-dlna [--host <host>] [--create-device-config] [--update-device-config]
                     [--msearch-port=<msearch-port>] [--ssdp-mx <ssdp-mx>] [--ssdp-ttl <ssdp-ttl>] [--ssdp-amount <ssdp-amount>]
     pulseaudio-dlna [-h | --help | --version]
@@ -60,13 +63,43 @@ Options:
                                              - generic (default)
                                              - ffmpeg
                                              - avconv
+                                             - pyav (in-process, requires python-av)
+    --latency=<profile>                    Set the encoders' latency profile [default: balanced].
+                                           Possible profiles are:
+                                             - low        Flush every packet and use small frames
+                                             - balanced   The encoders' defaults
+                                             - efficient  Prefer larger frames over latency
+    --recorder=<recorder>                  Set how audio is captured from the sinks [default: parec].
+                                           Possible recorders are:
+                                             - parec     Spawn a parec process per stream
+                                             - libpulse  Read in-process via libpulse-simple
+    --capture-latency=<msec>               Set the capture latency target in milliseconds.
+    --fragment-size=<bytes>                Set the capture fragment size in bytes. Overrides --capture-latency.
     -b --bit-rate=<rate>                   Set the audio encoder's bitrate.
     --filter-device=<filter-device>        Set a name filter for devices which should be added.
                                            Devices which get discovered, but won't match the
                                            filter text will be skipped.
     --renderer-urls=<urls>                 Set the renderer urls yourself. no discovery will commence.
     --request-timeout=<timeout>            Set the timeout for requests in seconds [default: 15].
-    --chunk-size=<chunk-size>              Set the stream's chunk size [default: 4096].
+    --chunk-size=<chunk-size>              Set the stream's read size in bytes. By default it is derived from the codec's
+                                           bit rate, or the recorded audio's rate for in-process encoders, and the latency profile.
+    --buffer-policy=<policy>               Set what happens when a client falls behind the stream by more than
+                                           --buffer-size seconds [default: drop].
+                                           Possible policies are:
+                                             - block       Pause the encoder until the client caught up
+                                             - drop        Drop the oldest buffered audio
+                                             - disconnect  Disconnect the client
+    --buffer-size=<seconds>                Set the amount of audio buffered per client in seconds [default: 5].
+    --server-mode=<mode>                   Set how the stream server handles connections [default: threaded].
+                                           Possible modes are:
+                                             - threaded     Every connection is served by its own thread
+                                             - mainloop     All connections are served by the main loop, only
+                                                            the recorder and encoder pipelines use threads
+    --range-buffer=<seconds>               If set, that many seconds of each stream are kept after it was sent. Devices which
+                                           reconnect with a range request are then resumed at the requested byte.
+    --suspend-on-silence=<seconds>         If set, the encoder of a stream is suspended after that many seconds of silence and a
+                                           previously encoded silent frame is repeated until audio is played again.
+                                           Supported for mp3, aac, wav and l16.
     --ssdp-ttl=<ssdp-ttl>                  Set the SSDP socket's TTL [default: 10].
     --ssdp-mx=<ssdp-mx>                    Set the MX value of the SSDP discovery message [default: 3].
     --ssdp-amount=<ssdp-amount>            Set the amount of SSDP discovery messages being sent [default: 5].
@@ -79,12 +112,20 @@ Options:
                                              - application    The audio application's icon is shown
     --debug                                enables detailed debug messages.
     --auto-reconnect                       If set, the application tries to reconnect devices in case the stream collapsed
+    --passthrough                          If set, devices which accept AC-3, E-AC-3 or DTS get bridges which forward those formats
+                                           unchanged when they arrive as IEC 61937 (S/PDIF) frames. Other streams are encoded as usual.
+    --prewarm                              If set, the recorder and encoder are started as soon as audio is played to a device's sink
+                                           instead of when the device connects, so the stream starts without encoder start-up delay.
+    --latency-probe                        If set, the delay of each stream's capture, encode, queue and send stages is measured
+                                           and logged every few seconds.
     --fake-http-content-length             If set, the content-length of HTTP requests will be set to 100 GB.
     --disable-switchback                   If set, streams won't switched back to the default sink if a device disconnects.
     --disable-ssdp-listener                If set, the application won't bind to the port 1900 and therefore the automatic discovery of new devices won't work.
     --disable-device-stop                  If set, the application won't send any stop commands to renderers at all
     --disable-workarounds                  If set, the application won't apply any device workarounds
     --disable-mimetype-check               If set, the application won't check the device's mime type capabilities
+    --disable-splice                       If set, a stream with a single client is always copied through the application instead of
+                                           being spliced from the encoder to the client's socket by the kernel
     -v --version                           Show the version.
     -h --help                              Show the help.
 
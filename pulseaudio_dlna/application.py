@@ -35,6 +35,7 @@ import pulseaudio_dlna.plugins.dlna.ssdp.discover
 import pulseaudio_dlna.plugins.chromecast
 import pulseaudio_dlna.plugins.chromecast.mdns
 import pulseaudio_dlna.encoders
+import pulseaudio_dlna.recorders
 import pulseaudio_dlna.covermodes
 import pulseaudio_dlna.streamserver
 import pulseaudio_dlna.pulseaudio
@@ -128,12 +129,44 @@ class Application(object):
         if options['--disable-mimetype-check']:
             pulseaudio_dlna.plugins.renderer.DISABLE_MIMETYPE_CHECK = True
 
+        if options['--disable-splice']:
+            pulseaudio_dlna.streamserver.ProcessThread.SPLICE = False
+
         if options['--chunk-size']:
             chunk_size = int(options['--chunk-size'])
             if chunk_size > 0:
                 pulseaudio_dlna.streamserver.ProcessThread.CHUNK_SIZE = \
                     chunk_size
 
+        buffer_policy = options['--buffer-policy']
+        if buffer_policy not in \
+                pulseaudio_dlna.streamserver.ProcessQueue.POLICIES:
+            logger.error('You specified an unknown buffer policy "{}"!'.format(
+                buffer_policy))
+            sys.exit(1)
+        pulseaudio_dlna.streamserver.ProcessQueue.POLICY = buffer_policy
+
+        if options['--buffer-size']:
+            buffer_size = float(options['--buffer-size'])
+            if buffer_size > 0:
+                pulseaudio_dlna.streamserver.ProcessQueue.MAX_DELAY = \
+                    buffer_size
+
+        if options['--range-buffer']:
+            range_buffer = float(options['--range-buffer'])
+            if range_buffer > 0:
+                pulseaudio_dlna.streamserver.ProcessThread.REPLAY_SIZE = \
+                    range_buffer
+
+        if options['--suspend-on-silence']:
+            silence_timeout = float(options['--suspend-on-silence'])
+            if silence_timeout > 0:
+                pulseaudio_dlna.streamserver.ProcessThread.SILENCE_TIMEOUT = \
+                    silence_timeout
+
+        if options['--latency-probe']:
+            pulseaudio_dlna.streamserver.LatencyProbe.ENABLED = True
+
         if options['--ssdp-ttl']:
             ssdp_ttl = int(options['--ssdp-ttl'])
             pulseaudio_dlna.plugins.dlna.ssdp.discover.\
@@ -175,6 +208,27 @@ class Application(object):
             except pulseaudio_dlna.codecs.UnknownBackendException as e:
                 logger.error(e)
                 sys.exit(1)
+            if options['--encoder-backend'] == 'pyav' and \
+               not pulseaudio_dlna.encoders.pyav.is_available():
+                logger.error(
+                    'The backend "pyav" requires the module "av" '
+                    '(python-av) to be installed!')
+                sys.exit(1)
+
+        try:
+            pulseaudio_dlna.recorders.set_backend(options['--recorder'])
+        except (pulseaudio_dlna.recorders.UnknownBackendException,
+                pulseaudio_dlna.recorders.MissingLibraryException) as e:
+            logger.error(e)
+            sys.exit(1)
+
+        if options['--capture-latency']:
+            pulseaudio_dlna.recorders.BaseRecorder.LATENCY = int(
+                options['--capture-latency'])
+
+        if options['--fragment-size']:
+            pulseaudio_dlna.recorders.BaseRecorder.FRAGMENT_SIZE = int(
+                options['--fragment-size'])
 
         if options['--encoder']:
             logger.warning(
@@ -188,6 +242,12 @@ class Application(object):
                 logger.error(e)
                 sys.exit(1)
 
+        try:
+            pulseaudio_dlna.encoders.set_latency_profile(options['--latency'])
+        except pulseaudio_dlna.encoders.UnknownLatencyProfileException as e:
+            logger.error(e)
+            sys.exit(1)
+
         bit_rate = options['--bit-rate']
         if bit_rate:
             try:
@@ -238,10 +298,25 @@ class Application(object):
         if options['--auto-reconnect']:
             disable_auto_reconnect = False
 
+        passthrough = False
+        if options['--passthrough']:
+            passthrough = True
+
+        prewarm = False
+        if options['--prewarm']:
+            prewarm = True
+
         pulse_queue = multiprocessing.Queue()
         stream_queue = multiprocessing.Queue()
 
-        stream_server = pulseaudio_dlna.streamserver.ThreadedStreamServer(
+        stream_server_class = pulseaudio_dlna.streamserver.SERVER_MODES.get(
+            options['--server-mode'], None)
+        if stream_server_class is None:
+            logger.error('You specified an unknown server mode "{}"!'.format(
+                options['--server-mode']))
+            sys.exit(1)
+
+        stream_server = stream_server_class(
             host, port, pulse_queue, stream_queue,
             fake_http_content_length=fake_http_content_length,
             proc_title='stream_server',
@@ -252,6 +327,8 @@ class Application(object):
             disable_switchback=disable_switchback,
             disable_device_stop=disable_device_stop,
             disable_auto_reconnect=disable_auto_reconnect,
+            passthrough=passthrough,
+            prewarm=prewarm,
             cover_mode=cover_mode,
             proc_title='pulse_watcher',
         )
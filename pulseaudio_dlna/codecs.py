@@ -21,6 +21,7 @@ import functools
 import logging
 import re
 import inspect
+import struct
 import sys
 
 import pulseaudio_dlna.encoders
@@ -28,7 +29,7 @@ import pulseaudio_dlna.rules
 
 logger = logging.getLogger('pulseaudio_dlna.codecs')
 
-BACKENDS = ['generic', 'ffmpeg', 'avconv', 'pulseaudio']
+BACKENDS = ['generic', 'ffmpeg', 'avconv', 'pulseaudio', 'pyav']
 CODECS = {}
 
 
@@ -68,6 +69,8 @@ def set_codecs(identifiers):
     step = 3
     priority = (len(CODECS) + 1) * step
     for identifier, _type in CODECS.iteritems():
+        if _type.PASSTHROUGH:
+            continue
         _type.ENABLED = False
         _type.PRIORITY = 0
     for identifier in identifiers:
@@ -82,11 +85,145 @@ def set_codecs(identifiers):
 def enabled_codecs():
     codecs = []
     for identifier, _type in CODECS.iteritems():
-        if _type.ENABLED:
+        if _type.ENABLED and not _type.PASSTHROUGH:
             codecs.append(_type())
     return codecs
 
 
+def _find_sync(data, is_sync):
+    index = data.find(b'\xff')
+    while index != -1 and index + 1 < len(data):
+        if is_sync(data, index):
+            return index
+        index = data.find(b'\xff', index + 1)
+    return None
+
+
+def _is_mp3_sync(data, index):
+    if index + 2 >= len(data):
+        return False
+    b1, b2 = ord(data[index + 1]), ord(data[index + 2])
+    return ((b1 & 0xe0) == 0xe0 and (b1 >> 3) & 0x03 != 0x01 and
+            (b1 >> 1) & 0x03 != 0x00 and (b2 >> 4) not in [0x00, 0x0f] and
+            (b2 >> 2) & 0x03 != 0x03)
+
+
+def _is_adts_sync(data, index):
+    return (ord(data[index + 1]) & 0xf6) == 0xf0
+
+
+def _is_flac_sync(data, index):
+    return (ord(data[index + 1]) & 0xfe) == 0xf8
+
+
+MP3_BIT_RATES = {
+    0x03: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    0x02: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {
+    0x03: [44100, 48000, 32000],
+    0x02: [22050, 24000, 16000],
+    0x00: [11025, 12000, 8000],
+}
+ADTS_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000,
+                     22050, 16000, 12000, 11025, 8000, 7350]
+
+
+def _mp3_frame_info(data, index):
+    if index + 4 > len(data) or ord(data[index]) != 0xff or \
+       not _is_mp3_sync(data, index):
+        return None
+    b1, b2 = ord(data[index + 1]), ord(data[index + 2])
+    version = (b1 >> 3) & 0x03
+    if (b1 >> 1) & 0x03 != 0x01:
+        return None
+    bit_rate = MP3_BIT_RATES[0x03 if version == 0x03 else 0x02][b2 >> 4]
+    sample_rate = MP3_SAMPLE_RATES[version][(b2 >> 2) & 0x03]
+    padding = (b2 >> 1) & 0x01
+    if version == 0x03:
+        return 144000 * bit_rate // sample_rate + padding, 1152, sample_rate
+    return 72000 * bit_rate // sample_rate + padding, 576, sample_rate
+
+
+def _adts_frame_info(data, index):
+    if index + 7 > len(data) or ord(data[index]) != 0xff or \
+       not _is_adts_sync(data, index):
+        return None
+    b2, b3, b4, b5, b6 = [ord(c) for c in data[index + 2:index + 7]]
+    sample_rate_index = (b2 >> 2) & 0x0f
+    length = ((b3 & 0x03) << 11) | (b4 << 3) | (b5 >> 5)
+    if sample_rate_index >= len(ADTS_SAMPLE_RATES) or length < 7:
+        return None
+    return (length, 1024 * ((b6 & 0x03) + 1),
+            ADTS_SAMPLE_RATES[sample_rate_index])
+
+
+def _iter_frames(data, frame_info, is_sync, header_size):
+    position = 0
+    while position + header_size <= len(data):
+        info = frame_info(data, position)
+        if info is None:
+            index = _find_sync(data[position + 1:], is_sync)
+            if index is None:
+                position = max(position + 1, len(data) - header_size + 1)
+                yield position, None
+                continue
+            position += 1 + index
+            yield position, None
+            continue
+        length, samples, sample_rate = info
+        if position + length > len(data):
+            break
+        yield position + length, (
+            data[position:position + length], float(samples) / sample_rate)
+        position += length
+
+
+def _split_frames(data, frame_info, is_sync, header_size):
+    end = 0
+    for end, frame in _iter_frames(data, frame_info, is_sync, header_size):
+        pass
+    return data[:end], data[end:]
+
+
+def _last_frame(data, frame_info, is_sync, header_size):
+    last_frame = None
+    for end, frame in _iter_frames(data, frame_info, is_sync, header_size):
+        if frame is not None:
+            last_frame = frame
+    return last_frame
+
+
+def _riff_header_size(data):
+    if len(data) < 12 or data[0:4] not in [b'RIFF', b'RIFX']:
+        return None
+    endian = '<' if data[0:4] == b'RIFF' else '>'
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack(
+            endian + 'I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'data':
+            return offset + 8
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _ogg_header_size(data):
+    offset = 0
+    while data[offset:offset + 4] == b'OggS' and offset + 27 <= len(data):
+        granule_position = struct.unpack(
+            '<q', data[offset + 6:offset + 14])[0]
+        if granule_position != 0:
+            return offset
+        segments = ord(data[offset + 26:offset + 27])
+        if offset + 27 + segments > len(data):
+            return None
+        offset += 27 + segments + sum(
+            ord(c) for c in data[offset + 27:offset + 27 + segments])
+    return None
+
+
 @functools.total_ordering
 class BaseCodec(object):
 
@@ -94,6 +231,8 @@ class BaseCodec(object):
     IDENTIFIER = None
     BACKEND = 'generic'
     PRIORITY = None
+    PASSTHROUGH = False
+    SILENCE_REPLAY = False
 
     def __init__(self):
         self.mime_type = None
@@ -138,10 +277,28 @@ class BaseCodec(object):
                 return True
         return False
 
+    @property
+    def alignment(self):
+        return 1
+
+    def header_size(self, data):
+        return None
+
+    def frame_start(self, data, position):
+        return 0
+
+    def split_frames(self, data):
+        return data, b''
+
+    def silent_frame(self, data):
+        return None
+
     def get_recorder(self, monitor):
         if self.BACKEND == 'pulseaudio':
             return pulseaudio_dlna.recorders.PulseaudioRecorder(
                 monitor, codec=self)
+        elif pulseaudio_dlna.recorders.BACKEND == 'libpulse':
+            return pulseaudio_dlna.recorders.PulseSimpleRecorder(monitor)
         else:
             return pulseaudio_dlna.recorders.PulseaudioRecorder(monitor)
 
@@ -200,8 +357,10 @@ class Mp3Codec(BitRateMixin, BaseCodec):
         'generic': pulseaudio_dlna.encoders.LameMp3Encoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegMp3Encoder,
         'avconv': pulseaudio_dlna.encoders.AVConvMp3Encoder,
+        'pyav': pulseaudio_dlna.encoders.PyAVMp3Encoder,
     }
     PRIORITY = 18
+    SILENCE_REPLAY = True
 
     def __init__(self, mime_string=None):
         BaseCodec.__init__(self)
@@ -209,35 +368,83 @@ class Mp3Codec(BitRateMixin, BaseCodec):
         self.suffix = 'mp3'
         self.mime_type = mime_string or 'audio/mp3'
 
+    def header_size(self, data):
+        if data[0:3] != b'ID3' or len(data) < 10:
+            return 0
+        size = 0
+        for c in data[6:10]:
+            size = (size << 7) | (ord(c) & 0x7f)
+        return 10 + size + (10 if ord(data[5]) & 0x10 else 0)
+
+    def frame_start(self, data, position):
+        return _find_sync(data, _is_mp3_sync)
+
+    def split_frames(self, data):
+        return _split_frames(data, _mp3_frame_info, _is_mp3_sync, 4)
+
+    def silent_frame(self, data):
+        frame = _last_frame(data, _mp3_frame_info, _is_mp3_sync, 4)
+        if frame is None:
+            return None
+        # A frame can only be repeated if it does not borrow bits from the
+        # reservoir of its predecessor.
+        frame_data = frame[0]
+        offset = 4 if ord(frame_data[1]) & 0x01 else 6
+        if len(frame_data) <= offset + 1:
+            return None
+        if ord(frame_data[offset]) != 0 or \
+           (ord(frame_data[1]) >> 3) & 0x03 == 0x03 and \
+           ord(frame_data[offset + 1]) & 0x80:
+            return None
+        return frame
+
 
 class WavCodec(BaseCodec):
 
     SUPPORTED_MIME_TYPES = ['audio/wav', 'audio/x-wav']
     IDENTIFIER = 'wav'
     ENCODERS = {
-        'generic': pulseaudio_dlna.encoders.SoxWavEncoder,
+        'generic': pulseaudio_dlna.encoders.BuiltinWavEncoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegWavEncoder,
         'avconv': pulseaudio_dlna.encoders.AVConvWavEncoder,
+        'pyav': pulseaudio_dlna.encoders.BuiltinWavEncoder,
         'pulseaudio': pulseaudio_dlna.encoders.NullEncoder,
     }
     PRIORITY = 15
+    SILENCE_REPLAY = True
 
     def __init__(self, mime_string=None):
         BaseCodec.__init__(self)
         self.suffix = 'wav'
         self.mime_type = mime_string or 'audio/wav'
 
+    @property
+    def alignment(self):
+        return 4
+
+    def silent_frame(self, data):
+        return b'\x00' * self.alignment, 1.0 / 44100
+
+    def header_size(self, data):
+        return _riff_header_size(data)
+
+    def frame_start(self, data, position):
+        offset = -position % self.alignment
+        return offset if offset < len(data) else None
+
 
 class L16Codec(BaseCodec):
 
     SUPPORTED_MIME_TYPES = ['audio/l16']
     IDENTIFIER = 'l16'
     ENCODERS = {
-        'generic': pulseaudio_dlna.encoders.SoxL16Encoder,
+        'generic': pulseaudio_dlna.encoders.BuiltinL16Encoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegL16Encoder,
         'avconv': pulseaudio_dlna.encoders.AVConvL16Encoder,
+        'pyav': pulseaudio_dlna.encoders.BuiltinL16Encoder,
     }
     PRIORITY = 1
+    SILENCE_REPLAY = True
 
     def __init__(self, mime_string=None):
         BaseCodec.__init__(self)
@@ -269,6 +476,20 @@ class L16Codec(BaseCodec):
     def encoder(self):
         return self.encoder_type(self.sample_rate, self.channels)
 
+    @property
+    def alignment(self):
+        return (self.channels or 2) * 2
+
+    def silent_frame(self, data):
+        return b'\x00' * self.alignment, 1.0 / (self.sample_rate or 44100)
+
+    def header_size(self, data):
+        return _riff_header_size(data)
+
+    def frame_start(self, data, position):
+        offset = -position % self.alignment
+        return offset if offset < len(data) else None
+
     def __eq__(self, other):
         return type(self) is type(other) and (
             self.sample_rate == other.sample_rate and
@@ -288,8 +509,10 @@ class AacCodec(BitRateMixin, BaseCodec):
         'generic': pulseaudio_dlna.encoders.FaacAacEncoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegAacEncoder,
         'avconv': pulseaudio_dlna.encoders.AVConvAacEncoder,
+        'pyav': pulseaudio_dlna.encoders.PyAVAacEncoder,
     }
     PRIORITY = 12
+    SILENCE_REPLAY = True
 
     def __init__(self, mime_string=None):
         BaseCodec.__init__(self)
@@ -297,6 +520,18 @@ class AacCodec(BitRateMixin, BaseCodec):
         self.suffix = 'aac'
         self.mime_type = mime_string or 'audio/aac'
 
+    def header_size(self, data):
+        return 0
+
+    def frame_start(self, data, position):
+        return _find_sync(data, _is_adts_sync)
+
+    def split_frames(self, data):
+        return _split_frames(data, _adts_frame_info, _is_adts_sync, 7)
+
+    def silent_frame(self, data):
+        return _last_frame(data, _adts_frame_info, _is_adts_sync, 7)
+
 
 class OggCodec(BitRateMixin, BaseCodec):
 
@@ -306,6 +541,7 @@ class OggCodec(BitRateMixin, BaseCodec):
         'generic': pulseaudio_dlna.encoders.OggencOggEncoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegOggEncoder,
         'avconv': pulseaudio_dlna.encoders.AVConvOggEncoder,
+        'pyav': pulseaudio_dlna.encoders.PyAVOggEncoder,
         'pulseaudio': pulseaudio_dlna.encoders.NullEncoder,
     }
     PRIORITY = 6
@@ -316,6 +552,13 @@ class OggCodec(BitRateMixin, BaseCodec):
         self.suffix = 'ogg'
         self.mime_type = mime_string or 'audio/ogg'
 
+    def header_size(self, data):
+        return _ogg_header_size(data)
+
+    def frame_start(self, data, position):
+        index = data.find(b'OggS')
+        return index if index != -1 else None
+
 
 class FlacCodec(BaseCodec):
 
@@ -325,6 +568,7 @@ class FlacCodec(BaseCodec):
         'generic': pulseaudio_dlna.encoders.FlacFlacEncoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegFlacEncoder,
         'avconv': pulseaudio_dlna.encoders.AVConvFlacEncoder,
+        'pyav': pulseaudio_dlna.encoders.PyAVFlacEncoder,
         'pulseaudio': pulseaudio_dlna.encoders.NullEncoder,
     }
     PRIORITY = 9
@@ -334,6 +578,21 @@ class FlacCodec(BaseCodec):
         self.suffix = 'flac'
         self.mime_type = mime_string or 'audio/flac'
 
+    def header_size(self, data):
+        if data[0:4] != b'fLaC':
+            return None
+        offset = 4
+        while offset + 4 <= len(data):
+            is_last = ord(data[offset]) & 0x80
+            offset += 4 + struct.unpack(
+                '>I', b'\x00' + data[offset + 1:offset + 4])[0]
+            if is_last:
+                return offset if offset <= len(data) else None
+        return None
+
+    def frame_start(self, data, position):
+        return _find_sync(data, _is_flac_sync)
+
 
 class OpusCodec(BitRateMixin, BaseCodec):
 
@@ -343,6 +602,7 @@ class OpusCodec(BitRateMixin, BaseCodec):
         'generic': pulseaudio_dlna.encoders.OpusencOpusEncoder,
         'ffmpeg': pulseaudio_dlna.encoders.FFMpegOpusEncoder,
         'avconv': pulseaudio_dlna.encoders.AVConvOpusEncoder,
+        'pyav': pulseaudio_dlna.encoders.PyAVOpusEncoder,
     }
     PRIORITY = 3
 
@@ -352,6 +612,76 @@ class OpusCodec(BitRateMixin, BaseCodec):
         self.suffix = 'opus'
         self.mime_type = mime_string or 'audio/opus'
 
+    def header_size(self, data):
+        return _ogg_header_size(data)
+
+    def frame_start(self, data, position):
+        index = data.find(b'OggS')
+        return index if index != -1 else None
+
+
+class PassthroughMixin(object):
+
+    PASSTHROUGH = True
+    PRIORITY = 0
+    ENCODERS = {}
+    DATA_TYPES = []
+    SAMPLE_RATE = 48000
+
+    @property
+    def encoder(self):
+        return self.encoder_type(self.DATA_TYPES)
+
+    @property
+    def encoder_type(self):
+        return pulseaudio_dlna.encoders.Iec61937Encoder
+
+    def get_recorder(self, monitor):
+        return pulseaudio_dlna.recorders.PassthroughRecorder(monitor)
+
+
+class Ac3Codec(PassthroughMixin, BaseCodec):
+
+    SUPPORTED_MIME_TYPES = [
+        'audio/ac3', 'audio/x-ac3', 'audio/vnd.dolby.dd-raw']
+    IDENTIFIER = 'ac3'
+    DATA_TYPES = [pulseaudio_dlna.encoders.IEC61937_AC3]
+
+    def __init__(self, mime_string=None):
+        BaseCodec.__init__(self)
+        self.suffix = 'ac3'
+        self.mime_type = mime_string or 'audio/ac3'
+
+
+class EAc3Codec(PassthroughMixin, BaseCodec):
+
+    SUPPORTED_MIME_TYPES = [
+        'audio/eac3', 'audio/x-eac3', 'audio/vnd.dolby.dd-plus']
+    IDENTIFIER = 'eac3'
+    DATA_TYPES = [pulseaudio_dlna.encoders.IEC61937_EAC3]
+    SAMPLE_RATE = 192000
+
+    def __init__(self, mime_string=None):
+        BaseCodec.__init__(self)
+        self.suffix = 'eac3'
+        self.mime_type = mime_string or 'audio/eac3'
+
+
+class DtsCodec(PassthroughMixin, BaseCodec):
+
+    SUPPORTED_MIME_TYPES = ['audio/vnd.dts', 'audio/x-dts', 'audio/dts']
+    IDENTIFIER = 'dts'
+    DATA_TYPES = [
+        pulseaudio_dlna.encoders.IEC61937_DTS1,
+        pulseaudio_dlna.encoders.IEC61937_DTS2,
+        pulseaudio_dlna.encoders.IEC61937_DTS3,
+    ]
+
+    def __init__(self, mime_string=None):
+        BaseCodec.__init__(self)
+        self.suffix = 'dts'
+        self.mime_type = mime_string or 'audio/vnd.dts'
+
 
 def load_codecs():
     if len(CODECS) == 0:
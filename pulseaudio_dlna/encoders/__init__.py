@@ -26,6 +26,11 @@ logger = logging.getLogger('pulseaudio_dlna.encoder')
 
 ENCODERS = []
 
+LATENCY_LOW = 'low'
+LATENCY_BALANCED = 'balanced'
+LATENCY_EFFICIENT = 'efficient'
+LATENCY_PROFILES = [LATENCY_LOW, LATENCY_BALANCED, LATENCY_EFFICIENT]
+
 
 class InvalidBitrateException(Exception):
     def __init__(self, bit_rate):
@@ -49,6 +54,20 @@ class UnsupportedBitrateException(Exception):
         )
 
 
+class UnknownLatencyProfileException(Exception):
+    def __init__(self, profile):
+        Exception.__init__(
+            self,
+            'You specified an unknown latency profile "{}"!'.format(profile),
+        )
+
+
+def set_latency_profile(profile):
+    if profile not in LATENCY_PROFILES:
+        raise UnknownLatencyProfileException(profile)
+    BaseEncoder.LATENCY_PROFILE = profile
+
+
 def set_bit_rate(bit_rate):
     try:
         bit_rate = int(bit_rate)
@@ -76,6 +95,8 @@ def _find_executable(path):
 class BaseEncoder(object):
 
     AVAILABLE = True
+    LATENCY_PROFILE = LATENCY_BALANCED
+    LATENCY_OPTIONS = {}
 
     def __init__(self):
         self._binary = None
@@ -99,6 +120,14 @@ class BaseEncoder(object):
     def writes_header(self):
         return self._writes_header
 
+    @property
+    def latency_options(self):
+        return list(self.LATENCY_OPTIONS.get(self.LATENCY_PROFILE, []))
+
+    @property
+    def bytes_per_second(self):
+        return 44100 * 2 * 2
+
     def validate(self):
         if not type(self).AVAILABLE:
             result = _find_executable(self.binary)
@@ -136,6 +165,10 @@ class BitRateMixin(object):
     def supported_bit_rates(self):
         return self.SUPPORTED_BIT_RATES
 
+    @property
+    def bytes_per_second(self):
+        return int(self.bit_rate) * 1000 / 8
+
     def __str__(self):
         return '<{} available="{}" bit-rate="{}">'.format(
             self.__class__.__name__,
@@ -162,6 +195,10 @@ class SamplerateChannelMixin(object):
     def channels(self, value):
         self._channels = int(value)
 
+    @property
+    def bytes_per_second(self):
+        return self.sample_rate * self.channels * 2
+
     def __str__(self):
         return '<{} available="{}" sample-rate="{}" channels="{}">'.format(
             self.__class__.__name__,
@@ -182,6 +219,8 @@ class NullEncoder(BaseEncoder):
 from pulseaudio_dlna.encoders.generic import *
 from pulseaudio_dlna.encoders.ffmpeg import *
 from pulseaudio_dlna.encoders.avconv import *
+from pulseaudio_dlna.encoders.builtin import *
+from pulseaudio_dlna.encoders.pyav import *
 
 
 def load_encoders():
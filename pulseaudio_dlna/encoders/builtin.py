@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import array
+import audioop
+import logging
+import struct
+import sys
+
+from pulseaudio_dlna.encoders import BaseEncoder, SamplerateChannelMixin
+
+logger = logging.getLogger('pulseaudio_dlna.encoder.builtin')
+
+IEC61937_PREAMBLE = b'\x72\xf8\x1f\x4e'
+IEC61937_NULL = 0x00
+IEC61937_AC3 = 0x01
+IEC61937_PAUSE = 0x03
+IEC61937_DTS1 = 0x0b
+IEC61937_DTS2 = 0x0c
+IEC61937_DTS3 = 0x0d
+IEC61937_EAC3 = 0x15
+
+IEC61937_MAX_BIT_RATES = {
+    IEC61937_AC3: 640,
+    IEC61937_DTS1: 1536,
+    IEC61937_DTS2: 1536,
+    IEC61937_DTS3: 1536,
+    IEC61937_EAC3: 6144,
+}
+
+
+def iec61937_data_type(data):
+    index = data.find(IEC61937_PREAMBLE)
+    while index != -1 and index + 8 <= len(data):
+        data_type = ord(data[index + 4]) & 0x1f
+        if data_type not in [IEC61937_NULL, IEC61937_PAUSE]:
+            return data_type
+        index = data.find(IEC61937_PREAMBLE, index + 8)
+    return None
+
+
+class BuiltinEncoder(BaseEncoder):
+
+    def __init__(self):
+        BaseEncoder.__init__(self)
+        self._binary = None
+
+    @property
+    def command(self):
+        return []
+
+    def validate(self):
+        type(self).AVAILABLE = True
+        return True
+
+    def reset(self):
+        pass
+
+    def encode(self, data):
+        raise NotImplementedError()
+
+
+class PcmEncoder(BuiltinEncoder):
+
+    SOURCE_SAMPLE_RATE = 44100
+    SOURCE_CHANNELS = 2
+
+    def __init__(self, sample_rate=None, channels=None, byte_order='little'):
+        BuiltinEncoder.__init__(self)
+        self._sample_rate = sample_rate or self.SOURCE_SAMPLE_RATE
+        self._channels = channels or self.SOURCE_CHANNELS
+        self.byte_order = byte_order
+        self.reset()
+
+    @property
+    def bytes_per_second(self):
+        return self._sample_rate * self._channels * 2
+
+    def reset(self):
+        self._remainder = b''
+        self._ratecv_state = None
+
+    def encode(self, data):
+        data = self._remainder + data
+        size = len(data) - len(data) % (self.SOURCE_CHANNELS * 2)
+        data, self._remainder = data[:size], data[size:]
+        if self._channels == 1 and self.SOURCE_CHANNELS == 2:
+            data = audioop.tomono(data, 2, 0.5, 0.5)
+        if self._sample_rate != self.SOURCE_SAMPLE_RATE:
+            data, self._ratecv_state = audioop.ratecv(
+                data, 2, self._channels, self.SOURCE_SAMPLE_RATE,
+                self._sample_rate, self._ratecv_state)
+        if self.byte_order != sys.byteorder:
+            samples = array.array(b'h', data)
+            samples.byteswap()
+            data = samples.tostring()
+        return data
+
+
+class BuiltinWavEncoder(PcmEncoder):
+
+    def __init__(self):
+        PcmEncoder.__init__(self, byte_order='little')
+        self._writes_header = True
+
+    @property
+    def header(self):
+        block_align = self._channels * 2
+        data_size = 0xffffffff - 36
+        return b''.join([
+            b'RIFF', struct.pack(b'<I', data_size + 36), b'WAVE',
+            b'fmt ', struct.pack(
+                b'<IHHIIHH', 16, 1, self._channels, self._sample_rate,
+                self._sample_rate * block_align, block_align, 16),
+            b'data', struct.pack(b'<I', data_size),
+        ])
+
+    def reset(self):
+        PcmEncoder.reset(self)
+        self._header_pending = True
+
+    def encode(self, data):
+        data = PcmEncoder.encode(self, data)
+        if self._header_pending:
+            self._header_pending = False
+            data = self.header + data
+        return data
+
+
+class BuiltinL16Encoder(SamplerateChannelMixin, PcmEncoder):
+
+    def __init__(self, sample_rate=None, channels=None):
+        PcmEncoder.__init__(
+            self, sample_rate=sample_rate, channels=channels,
+            byte_order='big')
+
+
+class Iec61937Encoder(BuiltinEncoder):
+
+    def __init__(self, data_types=None):
+        BuiltinEncoder.__init__(self)
+        self.data_types = data_types or []
+        self._buffer = b''
+
+    @property
+    def bytes_per_second(self):
+        bit_rates = [
+            IEC61937_MAX_BIT_RATES.get(data_type, 0)
+            for data_type in self.data_types]
+        return max(bit_rates or [0]) * 1000 / 8 or 48000 * 2 * 2
+
+    def reset(self):
+        self._buffer = b''
+
+    def encode(self, data):
+        buffer = self._buffer + data
+        frames = []
+        index = buffer.find(IEC61937_PREAMBLE)
+        while index != -1 and index + 8 <= len(buffer):
+            data_type = ord(buffer[index + 4]) & 0x1f
+            length = struct.unpack(b'<H', buffer[index + 6:index + 8])[0]
+            if data_type != IEC61937_EAC3:
+                length = length >> 3
+            end = index + 8 + length + (length & 1)
+            if end > len(buffer):
+                break
+            if data_type in self.data_types:
+                payload = array.array(b'H', buffer[index + 8:end])
+                payload.byteswap()
+                frames.append(payload.tostring()[:length])
+            index = buffer.find(IEC61937_PREAMBLE, end)
+
+        if index == -1:
+            self._buffer = buffer[-(len(IEC61937_PREAMBLE) - 1):]
+        else:
+            self._buffer = buffer[index:]
+        return b''.join(frames)
+
+    def __str__(self):
+        return '<{} available="{}" data-types="{}">'.format(
+            self.__class__.__name__,
+            unicode(self.available),
+            ','.join(unicode(data_type) for data_type in self.data_types),
+        )
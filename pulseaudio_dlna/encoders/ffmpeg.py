@@ -20,7 +20,8 @@ from __future__ import unicode_literals
 import logging
 
 from pulseaudio_dlna.encoders import (
-    BitRateMixin, SamplerateChannelMixin, BaseEncoder)
+    BitRateMixin, SamplerateChannelMixin, BaseEncoder, LATENCY_LOW,
+    LATENCY_EFFICIENT)
 
 logger = logging.getLogger('pulseaudio_dlna.encoder.ffmpeg')
 
@@ -32,6 +33,12 @@ class FFMpegMixin(object):
         command = [
             '-loglevel', 'panic',
         ]
+        if self.LATENCY_PROFILE == LATENCY_LOW:
+            command.extend([
+                '-fflags', 'nobuffer',
+                '-probesize', '32',
+                '-analyzeduration', '0',
+            ])
         command.extend([
             '-ac', '2',
             '-ar', '44100',
@@ -48,6 +55,9 @@ class FFMpegMixin(object):
             command.extend(['-ar', str(sample_rate)])
         if channels:
             command.extend(['-ac', str(channels)])
+        command.extend(self.latency_options)
+        if self.LATENCY_PROFILE == LATENCY_LOW:
+            command.extend(['-flush_packets', '1'])
         command.append('pipe:')
         return command
 
@@ -56,6 +66,9 @@ class FFMpegMp3Encoder(BitRateMixin, FFMpegMixin, BaseEncoder):
 
     SUPPORTED_BIT_RATES = [32, 40, 48, 56, 64, 80, 96, 112,
                            128, 160, 192, 224, 256, 320]
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['-reservoir', '0'],
+    }
 
     def __init__(self, bit_rate=None):
         BaseEncoder.__init__(self)
@@ -106,6 +119,9 @@ class FFMpegOggEncoder(BitRateMixin, FFMpegMixin, BaseEncoder):
 
     SUPPORTED_BIT_RATES = [32, 40, 48, 56, 64, 80, 96, 112,
                            128, 160, 192, 224, 256, 320]
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['-page_duration', '20000'],
+    }
 
     def __init__(self, bit_rate=None):
         BaseEncoder.__init__(self)
@@ -118,6 +134,10 @@ class FFMpegOggEncoder(BitRateMixin, FFMpegMixin, BaseEncoder):
 
 class FFMpegFlacEncoder(FFMpegMixin, BaseEncoder):
 
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['-frame_size', '1152'],
+    }
+
     def __init__(self):
         BaseEncoder.__init__(self)
 
@@ -129,6 +149,12 @@ class FFMpegFlacEncoder(FFMpegMixin, BaseEncoder):
 class FFMpegOpusEncoder(BitRateMixin, FFMpegMixin, BaseEncoder):
 
     SUPPORTED_BIT_RATES = [i for i in range(6, 257)]
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['-application', 'lowdelay', '-frame_duration', '10',
+                      '-page_duration', '20000'],
+        LATENCY_EFFICIENT: ['-application', 'audio',
+                            '-frame_duration', '60'],
+    }
 
     def __init__(self, bit_rate=None):
         BaseEncoder.__init__(self)
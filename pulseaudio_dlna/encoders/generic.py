@@ -20,7 +20,8 @@ from __future__ import unicode_literals
 import logging
 
 from pulseaudio_dlna.encoders import (
-    BitRateMixin, SamplerateChannelMixin, BaseEncoder)
+    BitRateMixin, SamplerateChannelMixin, BaseEncoder, LATENCY_LOW,
+    LATENCY_BALANCED, LATENCY_EFFICIENT)
 
 logger = logging.getLogger('pulseaudio_dlna.encoder.generic')
 
@@ -29,6 +30,9 @@ class LameMp3Encoder(BitRateMixin, BaseEncoder):
 
     SUPPORTED_BIT_RATES = [32, 40, 48, 56, 64, 80, 96, 112,
                            128, 160, 192, 224, 256, 320]
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['--nores', '--flush'],
+    }
 
     def __init__(self, bit_rate=None):
         BaseEncoder.__init__(self)
@@ -36,7 +40,8 @@ class LameMp3Encoder(BitRateMixin, BaseEncoder):
 
         self._writes_header = False
         self._binary = 'lame'
-        self._command = ['-b', str(self.bit_rate), '-r', '-']
+        self._command = ['-b', str(self.bit_rate)] + \
+            self.latency_options + ['-r', '-']
 
 
 class SoxWavEncoder(BaseEncoder):
@@ -103,6 +108,10 @@ class OggencOggEncoder(BitRateMixin, BaseEncoder):
 
 class FlacFlacEncoder(BaseEncoder):
 
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['--blocksize=1152'],
+    }
+
     def __init__(self, bit_rate=None):
         BaseEncoder.__init__(self)
 
@@ -110,12 +119,18 @@ class FlacFlacEncoder(BaseEncoder):
         self._binary = 'flac'
         self._command = ['-', '-c', '--channels', '2', '--bps', '16',
                          '--sample-rate', '44100',
-                         '--endian', 'little', '--sign', 'signed', '-s']
+                         '--endian', 'little', '--sign', 'signed', '-s'] + \
+            self.latency_options
 
 
 class OpusencOpusEncoder(BitRateMixin, BaseEncoder):
 
     SUPPORTED_BIT_RATES = [i for i in range(6, 257)]
+    LATENCY_OPTIONS = {
+        LATENCY_LOW: ['--max-delay', '0', '--framesize', '2.5'],
+        LATENCY_BALANCED: ['--max-delay', '0', '--framesize', '2.5'],
+        LATENCY_EFFICIENT: ['--max-delay', '1000', '--framesize', '20'],
+    }
 
     def __init__(self, bit_rate=None):
         BaseEncoder.__init__(self)
@@ -124,7 +139,5 @@ class OpusencOpusEncoder(BitRateMixin, BaseEncoder):
         self._writes_header = True
         self._binary = 'opusenc'
         self._command = ['--bitrate', str(self.bit_rate),
-                         '--padding', '0', '--max-delay', '0',
-                         '--expect-loss', '1', '--framesize', '2.5',
-                         '--raw-rate', '44100',
-                         '--raw', '-', '-']
+                         '--padding', '0', '--expect-loss', '1'] + \
+            self.latency_options + ['--raw-rate', '44100', '--raw', '-', '-']
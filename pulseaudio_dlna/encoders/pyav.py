@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import fractions
+import logging
+
+from pulseaudio_dlna.encoders import BitRateMixin
+from pulseaudio_dlna.encoders.builtin import BuiltinEncoder
+
+logger = logging.getLogger('pulseaudio_dlna.encoder.pyav')
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+def is_available():
+    return av is not None
+
+
+class _OutputBuffer(object):
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class PyAVMixin(object):
+
+    FORMAT = None
+    CODEC = None
+    SOURCE_SAMPLE_RATE = 44100
+    SAMPLE_RATE = 44100
+    CHANNELS = 2
+    LAYOUT = 'stereo'
+
+    def validate(self):
+        type(self).AVAILABLE = False
+        if av is None:
+            logger.debug('{} requires the "av" module.'.format(
+                self.__class__.__name__))
+            return False
+        try:
+            av.codec.Codec(self.CODEC, 'w')
+            type(self).AVAILABLE = True
+        except Exception:
+            logger.debug('libav was built without the "{}" encoder.'.format(
+                self.CODEC))
+        return type(self).AVAILABLE
+
+    def reset(self):
+        self._output = _OutputBuffer()
+        self._container = av.open(self._output, mode='w', format=self.FORMAT)
+        self._stream = self._container.add_stream(
+            self.CODEC, rate=self.SAMPLE_RATE)
+        self._stream.layout = self.LAYOUT
+        if getattr(self, 'bit_rate', None):
+            self._stream.bit_rate = int(self.bit_rate) * 1000
+        self._remainder = b''
+        self._pts = 0
+
+    def encode(self, data):
+        data = self._remainder + data
+        frame_size = self.CHANNELS * 2
+        size = len(data) - len(data) % frame_size
+        data, self._remainder = data[:size], data[size:]
+        if size == 0:
+            return b''
+
+        samples = size // frame_size
+        frame = av.AudioFrame(format='s16', layout=self.LAYOUT,
+                              samples=samples)
+        frame.planes[0].update(data)
+        frame.sample_rate = self.SOURCE_SAMPLE_RATE
+        frame.time_base = fractions.Fraction(1, self.SOURCE_SAMPLE_RATE)
+        frame.pts = self._pts
+        self._pts += samples
+
+        for packet in self._stream.encode(frame):
+            self._container.mux(packet)
+        return self._output.drain()
+
+
+class PyAVMp3Encoder(BitRateMixin, PyAVMixin, BuiltinEncoder):
+
+    SUPPORTED_BIT_RATES = [32, 40, 48, 56, 64, 80, 96, 112,
+                           128, 160, 192, 224, 256, 320]
+    FORMAT = 'mp3'
+    CODEC = 'libmp3lame'
+
+    def __init__(self, bit_rate=None):
+        BuiltinEncoder.__init__(self)
+        self.bit_rate = bit_rate or PyAVMp3Encoder.DEFAULT_BIT_RATE
+        self._writes_header = True
+
+
+class PyAVAacEncoder(BitRateMixin, PyAVMixin, BuiltinEncoder):
+
+    SUPPORTED_BIT_RATES = [32, 40, 48, 56, 64, 80, 96, 112,
+                           128, 160, 192, 224, 256, 320]
+    FORMAT = 'adts'
+    CODEC = 'aac'
+
+    def __init__(self, bit_rate=None):
+        BuiltinEncoder.__init__(self)
+        self.bit_rate = bit_rate or PyAVAacEncoder.DEFAULT_BIT_RATE
+        self._writes_header = False
+
+
+class PyAVOggEncoder(BitRateMixin, PyAVMixin, BuiltinEncoder):
+
+    SUPPORTED_BIT_RATES = [32, 40, 48, 56, 64, 80, 96, 112,
+                           128, 160, 192, 224, 256, 320]
+    FORMAT = 'ogg'
+    CODEC = 'libvorbis'
+
+    def __init__(self, bit_rate=None):
+        BuiltinEncoder.__init__(self)
+        self.bit_rate = bit_rate or PyAVOggEncoder.DEFAULT_BIT_RATE
+        self._writes_header = True
+
+
+class PyAVFlacEncoder(PyAVMixin, BuiltinEncoder):
+
+    FORMAT = 'flac'
+    CODEC = 'flac'
+
+    def __init__(self):
+        BuiltinEncoder.__init__(self)
+        self._writes_header = True
+
+
+class PyAVOpusEncoder(BitRateMixin, PyAVMixin, BuiltinEncoder):
+
+    SUPPORTED_BIT_RATES = [i for i in range(6, 257)]
+    FORMAT = 'opus'
+    CODEC = 'libopus'
+    SAMPLE_RATE = 48000
+
+    def __init__(self, bit_rate=None):
+        BuiltinEncoder.__init__(self)
+        self.bit_rate = bit_rate or PyAVOpusEncoder.DEFAULT_BIT_RATE
+        self._writes_header = True
@@ -20,6 +20,11 @@ from __future__ import with_statement
 
 import tempfile
 import logging
+import collections
+import hashlib
+import threading
+import time
+import os
 import gi
 
 logger = logging.getLogger('pulseaudio_dlna.images')
@@ -58,7 +63,47 @@ class MissingDependencies(Exception):
         )
 
 
-def get_icon_by_name(name, size=256):
+class ImageCache(object):
+
+    MAX_SIZE = 1024 * 1024 * 8
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or self.MAX_SIZE
+        self.size = 0
+        self.images = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.pop(key, None)
+            if image is not None:
+                self.images[key] = image
+            return image
+
+    def put(self, key, image):
+        size = len(image.data)
+        if size > self.max_size:
+            return image
+        with self.lock:
+            cached_image = self.images.pop(key, None)
+            if cached_image is not None:
+                self.size -= len(cached_image.data)
+            self.images[key] = image
+            self.size += size
+            while self.size > self.max_size:
+                _key, cached_image = self.images.popitem(last=False)
+                self.size -= len(cached_image.data)
+        return image
+
+IMAGE_CACHE = ImageCache()
+
+ICON_THEME_MTIME_TTL = 10
+
+_icon_theme_mtime = (None, None, 0)
+_icon_theme_mtime_lock = threading.Lock()
+
+
+def _get_icon_theme():
     try:
         gi.require_version('Gtk', '3.0')
         from gi.repository import Gtk
@@ -67,8 +112,60 @@ def get_icon_by_name(name, size=256):
             'Unable to lookup system icons!',
             ['gir1.2-gtk-3.0']
         )
+    return Gtk.IconTheme.get_default()
+
+
+def _get_icon_theme_mtime(icon_theme):
+    # Scanning the theme directories is only repeated every
+    # ICON_THEME_MTIME_TTL seconds instead of on every request.
+    global _icon_theme_mtime
+    search_path = tuple(icon_theme.get_search_path())
+    with _icon_theme_mtime_lock:
+        checked_at, checked_search_path, mtime = _icon_theme_mtime
+        if checked_at is None or checked_search_path != search_path or \
+           time.time() - checked_at >= ICON_THEME_MTIME_TTL:
+            mtime = _scan_icon_theme_mtime(search_path)
+            _icon_theme_mtime = (time.time(), search_path, mtime)
+        return mtime
+
+
+def _scan_icon_theme_mtime(search_path):
+    # Installing icons touches the theme directories or their caches, so
+    # their modification times tell when a cached lookup became stale.
+    mtime = 0
+    for path in search_path:
+        try:
+            mtime = max(mtime, os.path.getmtime(path))
+            for name in os.listdir(path):
+                mtime = max(mtime, os.path.getmtime(os.path.join(path, name)))
+        except EnvironmentError:
+            pass
+    return mtime
+
 
-    icon_theme = Gtk.IconTheme.get_default()
+def get_cached_icon_by_name(name, size=256):
+    icon_theme = _get_icon_theme()
+    key = ('sys-icon', name, size, _get_icon_theme_mtime(icon_theme))
+    image = IMAGE_CACHE.get(key)
+    if image is None:
+        image = IMAGE_CACHE.put(key, get_icon_by_name(name, size))
+    return image
+
+
+def get_cached_image_by_filepath(path):
+    try:
+        key = ('image', path, os.path.getmtime(path))
+    except EnvironmentError:
+        raise ImageNotAccessible(path)
+    image = IMAGE_CACHE.get(key)
+    if image is None:
+        _type = get_type_by_filepath(path)
+        image = IMAGE_CACHE.put(key, _type(path=path, cached=True))
+    return image
+
+
+def get_icon_by_name(name, size=256):
+    icon_theme = _get_icon_theme()
     icon = icon_theme.lookup_icon(name, size, 0)
     if icon:
         file_path = icon.get_filename()
@@ -93,10 +190,18 @@ class BaseImage(object):
         self.path = path
         self.content_type = None
         self.cached = cached
+        self.last_modified = self._get_mtime(path)
+        self._etag = None
 
         if self.cached:
             self._read_data()
 
+    def _get_mtime(self, path):
+        try:
+            return os.path.getmtime(path)
+        except EnvironmentError:
+            raise ImageNotAccessible(path)
+
     def _read_data(self):
         try:
             with open(self.path) as h:
@@ -111,6 +216,12 @@ class BaseImage(object):
         else:
             return self._read_data()
 
+    @property
+    def etag(self):
+        if self._etag is None:
+            self._etag = '"{}"'.format(hashlib.md5(self.data).hexdigest())
+        return self._etag
+
 
 class PngImage(BaseImage):
     def __init__(self, path, cached=True):
@@ -147,6 +258,8 @@ class SvgPngImage(BaseImage):
         image_surface.write_to_png(tmp_file.name)
 
         BaseImage.__init__(self, tmp_file.name, cached=True)
+        self.content_type = 'image/png'
+        self.last_modified = self._get_mtime(path)
 
 
 class JpgImage(BaseImage):
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger('pulseaudio_dlna.metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+METRICS = {}
+
+# Metrics are exposed by the stream server. The other processes set this to
+# the stream server's queue and their samples are recorded over there.
+FORWARD_QUEUE = None
+
+
+def set_forward_queue(queue):
+    global FORWARD_QUEUE
+    FORWARD_QUEUE = queue
+
+
+def record(name, method, value, labels):
+    metric = METRICS.get(name, None)
+    if metric is None:
+        logger.warning('Received a sample for the unknown metric "{}".'.format(
+            name))
+        return
+    getattr(metric, method)(value, **labels)
+
+
+def render():
+    lines = []
+    for name in sorted(METRICS.keys()):
+        lines.extend(METRICS[name].render())
+    return '\n'.join(lines + ['']).encode('utf-8')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = zip(label_names, label_values) + (extra or [])
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            unicode(value).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class BaseMetric(object):
+
+    TYPE = None
+
+    def __init__(self, name, description, label_names=None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names or [])
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS[name] = self
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def _forward(self, method, value, labels):
+        if FORWARD_QUEUE is None:
+            return False
+        FORWARD_QUEUE.put({
+            'type': 'record_metric',
+            'name': self.name,
+            'method': method,
+            'value': value,
+            'labels': labels,
+        })
+        return True
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+        with self.lock:
+            for key in sorted(self.values.keys()):
+                lines.extend(self._render_value(key, self.values[key]))
+        return lines
+
+    def _render_value(self, key, value):
+        return ['{}{} {}'.format(
+            self.name, _format_labels(self.label_names, key),
+            _format_value(value))]
+
+
+class Counter(BaseMetric):
+
+    TYPE = 'counter'
+
+    def inc(self, value=1, **labels):
+        if self._forward('inc', value, labels):
+            return
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(BaseMetric):
+
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        if self._forward('set', value, labels):
+            return
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class Histogram(BaseMetric):
+
+    TYPE = 'histogram'
+    BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, description, label_names=None, buckets=None):
+        BaseMetric.__init__(self, name, description, label_names)
+        self.buckets = sorted(buckets or self.BUCKETS) + [float('inf')]
+
+    def observe(self, value, **labels):
+        if self._forward('observe', value, labels):
+            return
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(
+                key, ([0] * len(self.buckets), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = counts, total + value
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        count = 0
+        for bucket, bucket_count in zip(self.buckets, counts):
+            count += bucket_count
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                _format_labels(
+                    self.label_names, key, [('le', _format_value(bucket))]),
+                count))
+        labels = _format_labels(self.label_names, key)
+        lines.append('{}_sum{} {}'.format(
+            self.name, labels, _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+STREAM_SENT_BYTES = Counter(
+    'pulseaudio_dlna_stream_sent_bytes_total',
+    'Bytes sent to the devices.', ['device', 'codec'])
+STREAM_DROPPED_BYTES = Counter(
+    'pulseaudio_dlna_stream_dropped_bytes_total',
+    'Bytes dropped for devices which fell behind.', ['device', 'codec'])
+STREAMS = Counter(
+    'pulseaudio_dlna_streams_total',
+    'Streams opened by the devices.', ['device', 'codec'])
+ACTIVE_STREAMS = Gauge(
+    'pulseaudio_dlna_active_streams',
+    'Streams currently connected.', ['device', 'codec'])
+QUEUE_BYTES = Gauge(
+    'pulseaudio_dlna_queue_bytes',
+    'Bytes waiting in the queue of a stream.', ['device', 'codec', 'stream'])
+ENCODER_RESTARTS = Counter(
+    'pulseaudio_dlna_encoder_restarts_total',
+    'Restarts of the recorder and encoder processes.', ['sink', 'codec'])
+ENCODER_SUSPENDED_SECONDS = Counter(
+    'pulseaudio_dlna_encoder_suspended_seconds_total',
+    'Time encoders were suspended because of silence.', ['sink', 'codec'])
+PLAY_TO_FIRST_BYTE_SECONDS = Histogram(
+    'pulseaudio_dlna_play_to_first_byte_seconds',
+    'Time from the play command until the device received data.',
+    ['device', 'codec'])
+RENDERER_COMMAND_SECONDS = Histogram(
+    'pulseaudio_dlna_renderer_command_seconds',
+    'Duration of the commands sent to the devices.',
+    ['device', 'command', 'status'])
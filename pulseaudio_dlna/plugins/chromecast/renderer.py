@@ -34,6 +34,8 @@ logger = logging.getLogger('pulseaudio_dlna.plugins.chromecast.renderer')
 
 class ChromecastRenderer(pulseaudio_dlna.plugins.renderer.BaseRenderer):
 
+    PREROLL = 2
+
     def __init__(
             self, name, ip, port, udn, model_name, model_number,
             model_description, manufacturer):
@@ -66,13 +68,14 @@ class ChromecastRenderer(pulseaudio_dlna.plugins.renderer.BaseRenderer):
 
     def play(self, url=None, codec=None, artist=None, title=None, thumb=None):
         self._before_play()
-        url = url or self.get_stream_url()
+        codec = codec or self.codec
+        url = url or self.get_stream_url(codec)
         try:
             cast = pycastv2.MediaPlayerController(
                 self.ip, self.port, self.REQUEST_TIMEOUT)
             cast.load(
                 url,
-                mime_type=self.codec.mime_type,
+                mime_type=codec.mime_type,
                 artist=artist,
                 title=title,
                 thumb=thumb)
@@ -92,7 +92,7 @@ class DLNAMediaRenderer(pulseaudio_dlna.plugins.renderer.BaseRenderer):
     def play(self, url=None, codec=None, artist=None, title=None, thumb=None):
         self._before_play()
         try:
-            stream_url = url or self.get_stream_url()
+            stream_url = url or self.get_stream_url(codec)
             self._register(
                 stream_url, codec, artist=artist, title=title, thumb=thumb)
             if pulseaudio_dlna.rules.DISABLE_PLAY_COMMAND in self.rules:
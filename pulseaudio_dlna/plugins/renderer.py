@@ -59,6 +59,7 @@ class BaseRenderer(object):
     STATE_STOPPED = 'STOPPED'
 
     REQUEST_TIMEOUT = 10
+    PREROLL = 1
 
     def __init__(self, udn, flavour, name=None, ip=None, port=None,
                  model_name=None, model_number=None,
@@ -80,6 +81,8 @@ class BaseRenderer(object):
         self._codecs = []
         self._rules = pulseaudio_dlna.rules.Rules()
         self._workarounds = []
+        self._group = None
+        self._latency = 0
 
         self.udn = udn
         self.flavour = flavour
@@ -131,6 +134,22 @@ class BaseRenderer(object):
     def manufacturer(self, value):
         self._manufacturer = value
 
+    @property
+    def group(self):
+        return self._group
+
+    @group.setter
+    def group(self, value):
+        self._group = value or None
+
+    @property
+    def latency(self):
+        return self._latency
+
+    @latency.setter
+    def latency(self, value):
+        self._latency = float(value or 0)
+
     @property
     def name(self):
         return self._name
@@ -184,6 +203,8 @@ class BaseRenderer(object):
     @property
     def codec(self):
         for codec in self.codecs:
+            if codec.PASSTHROUGH:
+                continue
             if codec.enabled and codec.encoder and codec.encoder.available:
                 return codec
 
@@ -191,7 +212,7 @@ class BaseRenderer(object):
         for codec in self.codecs:
             for identifier, encoder_type in codec.ENCODERS.items():
                 encoder = encoder_type()
-                if encoder.binary not in missing_encoders:
+                if encoder.binary and encoder.binary not in missing_encoders:
                     missing_encoders.append(encoder.binary)
 
         logger.info(
@@ -209,6 +230,11 @@ class BaseRenderer(object):
             'could lead to distortions or in rare cases to speaker damage!')
         raise NoEncoderFoundException()
 
+    @property
+    def passthrough_codecs(self):
+        return [codec for codec in self.codecs
+                if codec.PASSTHROUGH and codec.enabled]
+
     @property
     def flavour(self):
         return self._flavour
@@ -282,6 +308,8 @@ class BaseRenderer(object):
         for rule in self.rules:
             if type(rule) is pulseaudio_dlna.rules.REQUEST_TIMEOUT:
                 self.REQUEST_TIMEOUT = rule.timeout
+            if type(rule) is pulseaudio_dlna.rules.PREROLL:
+                self.PREROLL = rule.seconds
 
         if (pulseaudio_dlna.plugins.renderer.DISABLE_MIMETYPE_CHECK or
            pulseaudio_dlna.rules.DISABLE_MIMETYPE_CHECK in self.rules):
@@ -306,6 +334,8 @@ class BaseRenderer(object):
 
     def set_rules_from_config(self, config):
         self.name = config['name']
+        self.group = config.get('group', None)
+        self.latency = config.get('latency', None)
         for rule in config.get('rules', []):
             self.rules.append(rule)
         for codec_properties in config.get('codecs', []):
@@ -337,20 +367,35 @@ class BaseRenderer(object):
             ip=server_ip,
             port=server_port,
         )
+        return urlparse.urljoin(
+            base_url, self._encode_path(settings, suffix))
+
+    def _encode_path(self, settings, suffix=''):
         data_string = ','.join(
             ['{}="{}"'.format(k, v) for k, v in settings.iteritems()])
-        stream_name = '/{base_string}/{suffix}'.format(
+        return '/{base_string}/{suffix}'.format(
             base_string=urllib.quote(base64.b64encode(data_string)),
             suffix=suffix,
         )
-        return urlparse.urljoin(base_url, stream_name)
 
-    def get_stream_url(self):
+    def _get_stream_settings(self, codec):
         settings = {
             'type': 'bridge',
             'udn': self.udn,
         }
-        return self._encode_settings(settings, 'stream.' + self.codec.suffix)
+        if codec.PASSTHROUGH:
+            settings['codec'] = codec.IDENTIFIER
+        return settings
+
+    def get_stream_url(self, codec=None):
+        codec = codec or self.codec
+        return self._encode_settings(
+            self._get_stream_settings(codec), 'stream.' + codec.suffix)
+
+    def get_stream_path(self, codec=None):
+        codec = codec or self.codec
+        return self._encode_path(
+            self._get_stream_settings(codec), 'stream.' + codec.suffix)
 
     def get_image_url(self, name='default.png'):
         settings = {
@@ -431,4 +476,6 @@ class BaseRenderer(object):
             'flavour': self.flavour,
             'codecs': self.codecs,
             'rules': self.rules,
+            'group': self.group,
+            'latency': self.latency,
         }
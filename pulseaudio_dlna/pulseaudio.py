@@ -33,11 +33,15 @@ import re
 import traceback
 import concurrent.futures
 import collections
+import time
 
 import pulseaudio_dlna.plugins.renderer
+import pulseaudio_dlna.encoders
+import pulseaudio_dlna.recorders
 import pulseaudio_dlna.notification
 import pulseaudio_dlna.utils.encoding
 import pulseaudio_dlna.covermodes
+import pulseaudio_dlna.metrics
 
 logger = logging.getLogger('pulseaudio_dlna.pulseaudio')
 
@@ -47,17 +51,29 @@ MODULE_NULL_SINK = 'module-null-sink'
 
 class PulseAudio(object):
     def __init__(self):
-        self.streams = []
-        self.sinks = []
+        self.stream_map = collections.OrderedDict()
+        self.sink_map = collections.OrderedDict()
 
         self.fallback_sink = None
         self.system_sinks = []
 
+        self.bus = None
+        self.core = None
+
+    @property
+    def streams(self):
+        return list(self.stream_map.values())
+
+    @property
+    def sinks(self):
+        return list(self.sink_map.values())
+
     def _connect(self, signals):
         self.bus = self._get_bus()
         self.core = self.bus.get_object(object_path='/org/pulseaudio/core1')
         for sig_name, interface, sig_handler in signals:
-            self.bus.add_signal_receiver(sig_handler, sig_name)
+            self.bus.add_signal_receiver(
+                sig_handler, sig_name, path_keyword='object_path')
             self.core.ListenForSignal(
                 interface.format(sig_name), dbus.Array(signature='o'))
 
@@ -176,49 +192,177 @@ class PulseAudio(object):
                 count += 1
             return True
 
-        if retry_on_fail(self.update_playback_streams) and \
-           retry_on_fail(self.update_sinks):
-            for stream in self.streams:
-                for sink in self.sinks:
-                    if sink.object_path == stream.device:
-                        sink.streams.append(stream)
+        # Streams of the same client and sinks of the same module share
+        # those objects during one update.
+        cache = {}
+        if retry_on_fail(lambda: self.update_playback_streams(cache)) and \
+           retry_on_fail(lambda: self.update_sinks(cache)):
+            for sink in self.sinks:
+                sink.streams = [
+                    stream for stream in self.streams
+                    if stream.device == sink.object_path]
         else:
             logger.error(
                 'Could not update sinks and streams. This normally indicates '
                 'a problem with pulseaudio\'s dbus module. Try restarting '
                 'pulseaudio if the problem persists.')
 
-    def update_playback_streams(self):
+    def update_async(self, callback):
+        # Fetches all sinks and streams like update(), but without blocking
+        # the main loop. The maps are replaced at once when every object
+        # answered.
+        stream_map = collections.OrderedDict()
+        sink_map = collections.OrderedDict()
+        pending = [2]
+        errors = []
+
+        def on_done():
+            pending[0] -= 1
+            if pending[0] > 0:
+                return
+            if errors:
+                logger.error(
+                    'Could not update sinks and streams: {}'.format(
+                        errors[0]))
+                callback(False)
+                return
+            self.stream_map = collections.OrderedDict(
+                (path, stream) for path, stream in stream_map.items()
+                if stream)
+            self.sink_map = collections.OrderedDict(
+                (path, sink) for path, sink in sink_map.items() if sink)
+            for sink in self.sink_map.values():
+                sink.fallback_sink = self.fallback_sink
+                sink.streams = [
+                    stream for stream in self.stream_map.values()
+                    if stream.device == sink.object_path]
+            callback(True)
+
+        def on_object(objects, path, obj):
+            objects[path] = obj
+            on_done()
+
+        def on_paths(objects, factory, paths):
+            pending[0] += len(paths)
+            for path in paths:
+                # The entry keeps the order in which pulseaudio listed them.
+                objects[unicode(path)] = None
+                factory.new_async(self.bus, path, functools.partial(
+                    on_object, objects, unicode(path)))
+            on_done()
+
+        def on_error(error):
+            errors.append(error)
+            on_done()
+
+        for name, objects, factory in [
+                ('PlaybackStreams', stream_map, PulseStreamFactory),
+                ('Sinks', sink_map, PulseSinkFactory)]:
+            self.core.Get(
+                'org.PulseAudio.Core1', name,
+                dbus_interface='org.freedesktop.DBus.Properties',
+                reply_handler=functools.partial(on_paths, objects, factory),
+                error_handler=on_error)
+
+    def update_playback_streams(self, cache=None):
         try:
             stream_paths = self.core.Get(
                 'org.PulseAudio.Core1', 'PlaybackStreams',
                 dbus_interface='org.freedesktop.DBus.Properties')
 
-            self.streams = []
+            self.stream_map.clear()
             for stream_path in stream_paths:
-                stream = PulseStreamFactory.new(self.bus, stream_path)
+                stream = PulseStreamFactory.new(self.bus, stream_path, cache)
                 if stream:
-                    self.streams.append(stream)
+                    self.stream_map[stream.object_path] = stream
             return True
         except dbus.exceptions.DBusException:
             return False
 
-    def update_sinks(self):
+    def update_sinks(self, cache=None):
         try:
             sink_paths = self.core.Get(
                 'org.PulseAudio.Core1', 'Sinks',
                 dbus_interface='org.freedesktop.DBus.Properties')
 
-            self.sinks = []
+            self.sink_map.clear()
             for sink_path in sink_paths:
-                sink = PulseSinkFactory.new(self.bus, sink_path)
+                sink = PulseSinkFactory.new(self.bus, sink_path, cache)
                 if sink:
                     sink.fallback_sink = self.fallback_sink
-                    self.sinks.append(sink)
+                    self.sink_map[sink.object_path] = sink
             return True
         except dbus.exceptions.DBusException:
             return False
 
+    # The following methods patch the cached sinks and streams for a single
+    # object instead of fetching all of them again. The asynchronous ones
+    # call back from the main loop once pulseaudio answered.
+
+    def add_sink(self, sink_path):
+        return self._store_sink(PulseSinkFactory.new(self.bus, sink_path))
+
+    def add_sink_async(self, sink_path, callback=None):
+
+        def on_sink(sink):
+            sink = self._store_sink(sink)
+            if callback:
+                callback(sink)
+
+        PulseSinkFactory.new_async(self.bus, sink_path, on_sink)
+
+    def _store_sink(self, sink):
+        if sink:
+            sink.fallback_sink = self.fallback_sink
+            sink.streams = [
+                stream for stream in self.stream_map.values()
+                if stream.device == sink.object_path]
+            self.sink_map[sink.object_path] = sink
+        return sink
+
+    def remove_sink(self, sink_path):
+        return self.sink_map.pop(sink_path, None)
+
+    def add_playback_stream_async(self, stream_path, callback=None):
+
+        def on_stream(stream):
+            if stream:
+                self._detach_playback_stream(stream.object_path)
+                self.stream_map[stream.object_path] = stream
+                self._attach_playback_stream(stream)
+            if callback:
+                callback(stream)
+
+        PulseStreamFactory.new_async(self.bus, stream_path, on_stream)
+
+    def remove_playback_stream(self, stream_path):
+        stream = self.stream_map.pop(stream_path, None)
+        if stream:
+            self._detach_playback_stream(stream_path)
+        return stream
+
+    def move_playback_stream(self, stream_path, sink_path):
+        stream = self.stream_map.get(stream_path, None)
+        if stream is None:
+            self.add_playback_stream_async(stream_path)
+            return
+        self._detach_playback_stream(stream_path)
+        stream.device = unicode(sink_path)
+        self._attach_playback_stream(stream)
+
+    def _attach_playback_stream(self, stream):
+        sink = self.sink_map.get(stream.device, None)
+        if sink is None:
+            self.add_sink_async(stream.device)
+        elif stream not in sink.streams:
+            sink.streams.append(stream)
+
+    def _detach_playback_stream(self, stream_path):
+        for sink in self.sink_map.values():
+            sink.streams = [
+                stream for stream in sink.streams
+                if stream.object_path != stream_path]
+
     def dbus_server_lookup(self):
         try:
             lookup_object = dbus.SessionBus().get_object(
@@ -241,11 +385,29 @@ class PulseAudio(object):
             return [match[1] for match in matches]
         return None
 
+    # Modules are managed through pulseaudio's D-Bus interface once it is
+    # connected. pactl is only used before that, e.g. to load the D-Bus
+    # module itself.
+
     def load_module(self, module_name, options=None):
+        options = options or {}
+        if self.core is not None:
+            try:
+                module_path = self.core.LoadModule(
+                    module_name, self._module_arguments(options),
+                    dbus_interface='org.PulseAudio.Core1')
+                module = PulseModuleFactory.new(self.bus, module_path)
+                return int(module.index) if module else None
+            except dbus.exceptions.DBusException:
+                logger.info(traceback.format_exc())
+
+        # The values are quoted the same way pulseaudio does it for modules
+        # loaded via D-Bus.
         command = ['pactl', 'load-module', module_name]
-        if options:
-            for key, value in options.items():
-                command.append('{}={}'.format(key, value))
+        for key, value in options.items():
+            command.append('{}="{}"'.format(
+                key, unicode(value).replace('\\', '\\\\').replace(
+                    '"', '\\"')))
         process = subprocess.Popen(command, stdout=subprocess.PIPE)
         stdout, stderr = process.communicate()
         if process.returncode == 0:
@@ -253,6 +415,16 @@ class PulseAudio(object):
         return None
 
     def unload_module(self, module_id):
+        if self.core is not None:
+            try:
+                module = self.bus.get_object(
+                    object_path='/org/pulseaudio/core1/module{}'.format(
+                        module_id))
+                module.Unload(dbus_interface='org.PulseAudio.Core1.Module')
+                return
+            except dbus.exceptions.DBusException:
+                logger.info(traceback.format_exc())
+
         process = subprocess.Popen(
             ['pactl', 'unload-module', str(module_id)],
             stdout=subprocess.PIPE)
@@ -260,25 +432,101 @@ class PulseAudio(object):
         if process.returncode != 0:
             logger.error('Could not remove entity {id}'.format(id=module_id))
 
-    def create_null_sink(self, sink_name, sink_description):
+    def _module_arguments(self, options):
+        return dbus.Dictionary({
+            key: unicode(value) for key, value in options.items()
+        }, signature='ss')
+
+    def _null_sink_options(self, sink_name, sink_description, sample_rate):
         options = collections.OrderedDict([
-            ('sink_name', '"{}"'.format(sink_name)),
+            ('sink_name', sink_name),
             ('sink_properties', 'device.description="{}"'.format(
-                sink_description.replace(' ', '\ ')),)
+                sink_description.replace('\\', '\\\\').replace(
+                    '"', '\\"'))),
         ])
+        if sample_rate:
+            options['rate'] = sample_rate
+        return options
+
+    def create_null_sink(self, sink_name, sink_description, sample_rate=None):
+        options = self._null_sink_options(
+            sink_name, sink_description, sample_rate)
         module_id = self.load_module(MODULE_NULL_SINK, options)
         if module_id > 0:
-            self.update_sinks()
-            for sink in self.sinks:
-                if int(sink.module.index) == module_id:
-                    return sink
+            try:
+                sink_path = self.core.GetSinkByName(
+                    sink_name, dbus_interface='org.PulseAudio.Core1')
+            except dbus.exceptions.DBusException:
+                logger.error('Could not find the sink "{}".'.format(
+                    sink_name))
+                return None
+            return self.add_sink(sink_path)
+
+    def create_null_sink_async(self, sink_name, sink_description, callback,
+                               sample_rate=None):
+        # The module is loaded without waiting for the reply, so the sinks
+        # of several devices are requested from pulseaudio at once. If the
+        # D-Bus interface cannot load modules it falls back to pactl.
+
+        def on_error(error):
+            logger.info('Could not load the sink "{}" via D-Bus: {}'.format(
+                sink_name, error))
+            callback(self.create_null_sink(
+                sink_name, sink_description, sample_rate=sample_rate))
+
+        def on_sink_not_found(error):
+            logger.error('Could not find the sink "{}".'.format(sink_name))
+            callback(None)
+
+        def on_module_loaded(module_path):
+            self.core.GetSinkByName(
+                sink_name, dbus_interface='org.PulseAudio.Core1',
+                reply_handler=on_sink_found, error_handler=on_sink_not_found)
+
+        def on_sink_found(sink_path):
+            self.add_sink_async(sink_path, callback)
+
+        if self.core is None:
+            callback(self.create_null_sink(
+                sink_name, sink_description, sample_rate=sample_rate))
+            return
+        options = self._null_sink_options(
+            sink_name, sink_description, sample_rate)
+        self.core.LoadModule(
+            MODULE_NULL_SINK, self._module_arguments(options),
+            dbus_interface='org.PulseAudio.Core1',
+            reply_handler=on_module_loaded, error_handler=on_error)
 
     def delete_null_sink(self, module_id):
+        for sink in self.sinks:
+            if sink.module and sink.module.index == unicode(module_id):
+                self.remove_sink(sink.object_path)
         return self.unload_module(module_id)
 
 
 class PulseBaseFactory(object):
 
+    @classmethod
+    def _get_properties(self, obj, interface):
+        return obj.GetAll(
+            interface, dbus_interface='org.freedesktop.DBus.Properties')
+
+    @classmethod
+    def _get_properties_async(self, bus, object_path, interface, callback,
+                              error_level=logging.ERROR):
+
+        def on_error(error):
+            logger.log(
+                error_level,
+                '{name} - Could not get "{object_path}" from dbus.'.format(
+                    name=self.__name__, object_path=object_path))
+            callback(None)
+
+        obj = bus.get_object(object_path=object_path, introspect=False)
+        obj.GetAll(
+            interface, dbus_interface='org.freedesktop.DBus.Properties',
+            reply_handler=callback, error_handler=on_error)
+
     @classmethod
     def _convert_bytes_to_unicode(self, byte_array):
         name = bytes()
@@ -291,26 +539,48 @@ class PulseBaseFactory(object):
 class PulseClientFactory(PulseBaseFactory):
 
     @classmethod
-    def new(self, bus, client_path):
+    def _create(self, client_path, client_properties):
+        properties = client_properties['PropertyList']
+        name_bytes = properties.get('application.name', [])
+        icon_bytes = properties.get('application.icon_name', [])
+        binary_bytes = properties.get('application.process.binary', [])
+        return PulseClient(
+            object_path=unicode(client_path),
+            index=unicode(client_properties['Index']),
+            name=self._convert_bytes_to_unicode(name_bytes),
+            icon=self._convert_bytes_to_unicode(icon_bytes),
+            binary=self._convert_bytes_to_unicode(binary_bytes),
+        )
+
+    @classmethod
+    def new(self, bus, client_path, cache=None):
+        if cache is not None and client_path in cache:
+            return cache[client_path]
         try:
             obj = bus.get_object(object_path=client_path)
-            properties = obj.Get('org.PulseAudio.Core1.Client', 'PropertyList')
-            name_bytes = properties.get('application.name', [])
-            icon_bytes = properties.get('application.icon_name', [])
-            binary_bytes = properties.get('application.process.binary', [])
-            return PulseClient(
-                object_path=unicode(client_path),
-                index=unicode(obj.Get('org.PulseAudio.Core1.Client', 'Index')),
-                name=self._convert_bytes_to_unicode(name_bytes),
-                icon=self._convert_bytes_to_unicode(icon_bytes),
-                binary=self._convert_bytes_to_unicode(binary_bytes),
-            )
+            client = self._create(client_path, self._get_properties(
+                obj, 'org.PulseAudio.Core1.Client'))
+            if cache is not None:
+                cache[client_path] = client
+            return client
         except dbus.exceptions.DBusException:
             logger.error(
                 'PulseClientFactory - Could not get "{object_path}" '
                 'from dbus.'.format(object_path=client_path))
             return None
 
+    @classmethod
+    def new_async(self, bus, client_path, callback):
+
+        def on_properties(properties):
+            if properties is None:
+                callback(None)
+            else:
+                callback(self._create(client_path, properties))
+
+        self._get_properties_async(
+            bus, client_path, 'org.PulseAudio.Core1.Client', on_properties)
+
 
 @functools.total_ordering
 class PulseClient(object):
@@ -348,20 +618,42 @@ class PulseClient(object):
 class PulseModuleFactory(PulseBaseFactory):
 
     @classmethod
-    def new(self, bus, module_path):
+    def _create(self, module_path, properties):
+        return PulseModule(
+            object_path=unicode(module_path),
+            index=unicode(properties['Index']),
+            name=unicode(properties['Name']),
+        )
+
+    @classmethod
+    def new(self, bus, module_path, cache=None):
+        if cache is not None and module_path in cache:
+            return cache[module_path]
         try:
             obj = bus.get_object(object_path=module_path)
-            return PulseModule(
-                object_path=unicode(module_path),
-                index=unicode(obj.Get('org.PulseAudio.Core1.Module', 'Index')),
-                name=unicode(obj.Get('org.PulseAudio.Core1.Module', 'Name')),
-            )
+            module = self._create(module_path, self._get_properties(
+                obj, 'org.PulseAudio.Core1.Module'))
+            if cache is not None:
+                cache[module_path] = module
+            return module
         except dbus.exceptions.DBusException:
             logger.error(
                 'PulseModuleFactory - Could not get "{object_path}" '
                 'from dbus.'.format(object_path=module_path))
             return None
 
+    @classmethod
+    def new_async(self, bus, module_path, callback):
+
+        def on_properties(properties):
+            if properties is None:
+                callback(None)
+            else:
+                callback(self._create(module_path, properties))
+
+        self._get_properties_async(
+            bus, module_path, 'org.PulseAudio.Core1.Module', on_properties)
+
 
 @functools.total_ordering
 class PulseModule(object):
@@ -394,28 +686,48 @@ class PulseModule(object):
 class PulseSinkFactory(PulseBaseFactory):
 
     @classmethod
-    def new(self, bus, object_path):
+    def _create(self, object_path, device_properties, module):
+        properties = device_properties['PropertyList']
+        description_bytes = properties.get('device.description', [])
+        return PulseSink(
+            object_path=unicode(object_path),
+            index=unicode(device_properties['Index']),
+            name=unicode(device_properties['Name']),
+            label=self._convert_bytes_to_unicode(description_bytes),
+            module=module,
+        )
+
+    @classmethod
+    def new(self, bus, object_path, cache=None):
         try:
             obj = bus.get_object(object_path=object_path)
-
-            properties = obj.Get('org.PulseAudio.Core1.Device', 'PropertyList')
-            description_bytes = properties.get('device.description', [])
-            module_path = unicode(
-                obj.Get('org.PulseAudio.Core1.Device', 'OwnerModule'))
-
-            return PulseSink(
-                object_path=unicode(object_path),
-                index=unicode(obj.Get('org.PulseAudio.Core1.Device', 'Index')),
-                name=unicode(obj.Get('org.PulseAudio.Core1.Device', 'Name')),
-                label=self._convert_bytes_to_unicode(description_bytes),
-                module=PulseModuleFactory.new(bus, module_path),
-            )
+            properties = self._get_properties(
+                obj, 'org.PulseAudio.Core1.Device')
+            module_path = unicode(properties['OwnerModule'])
+            return self._create(
+                object_path, properties,
+                PulseModuleFactory.new(bus, module_path, cache))
         except dbus.exceptions.DBusException:
             logger.error(
                 'PulseSinkFactory - Could not get "{object_path}" '
                 'from dbus.'.format(object_path=object_path))
             return None
 
+    @classmethod
+    def new_async(self, bus, object_path, callback):
+
+        def on_properties(properties):
+            if properties is None:
+                callback(None)
+                return
+            PulseModuleFactory.new_async(
+                bus, unicode(properties['OwnerModule']),
+                lambda module: callback(
+                    self._create(object_path, properties, module)))
+
+        self._get_properties_async(
+            bus, object_path, 'org.PulseAudio.Core1.Device', on_properties)
+
 
 @functools.total_ordering
 class PulseSink(object):
@@ -436,7 +748,9 @@ class PulseSink(object):
         self.fallback_sink = fallback_sink
 
         self.monitor = self.name + '.monitor'
-        self.streams = []
+        # Fetching a sink again must not empty the streams of the shared
+        # state, they are only replaced once the update is complete.
+        self.streams = self.__dict__.get('streams', [])
 
     @property
     def stream_client_names(self):
@@ -492,28 +806,48 @@ class PulseSink(object):
         return string
 
 
-class PulseStreamFactory(object):
+class PulseStreamFactory(PulseBaseFactory):
 
     @classmethod
-    def new(self, bus, stream_path):
+    def _create(self, stream_path, properties, client):
+        return PulseStream(
+            object_path=unicode(stream_path),
+            index=unicode(properties['Index']),
+            device=unicode(properties['Device']),
+            client=client,
+        )
+
+    @classmethod
+    def new(self, bus, stream_path, cache=None):
         try:
             obj = bus.get_object(object_path=stream_path)
-            client_path = unicode(
-                obj.Get('org.PulseAudio.Core1.Stream', 'Client'))
-            return PulseStream(
-                object_path=unicode(stream_path),
-                index=unicode(obj.Get(
-                    'org.PulseAudio.Core1.Stream', 'Index')),
-                device=unicode(obj.Get(
-                    'org.PulseAudio.Core1.Stream', 'Device')),
-                client=PulseClientFactory.new(bus, client_path),
-            )
+            properties = self._get_properties(
+                obj, 'org.PulseAudio.Core1.Stream')
+            return self._create(
+                stream_path, properties, PulseClientFactory.new(
+                    bus, unicode(properties['Client']), cache))
         except dbus.exceptions.DBusException:
             logger.debug(
                 'PulseStreamFactory - Could not get "{object_path}" '
                 'from dbus.'.format(object_path=stream_path))
             return None
 
+    @classmethod
+    def new_async(self, bus, stream_path, callback):
+
+        def on_properties(properties):
+            if properties is None:
+                callback(None)
+                return
+            PulseClientFactory.new_async(
+                bus, unicode(properties['Client']),
+                lambda client: callback(
+                    self._create(stream_path, properties, client)))
+
+        self._get_properties_async(
+            bus, stream_path, 'org.PulseAudio.Core1.Stream', on_properties,
+            error_level=logging.DEBUG)
+
 
 @functools.total_ordering
 class PulseStream(object):
@@ -556,9 +890,41 @@ class PulseStream(object):
 
 
 class PulseBridge(object):
-    def __init__(self, sink, device):
+
+    PROBE_SIZE = 1024 * 64
+
+    def __init__(self, sink, device, passthrough=False, codec=None):
         self.sink = sink
         self.device = device
+        self.passthrough = passthrough
+        self._codec = codec
+
+    @property
+    def codec(self):
+        return self._codec or self.device.codec
+
+    @codec.setter
+    def codec(self, value):
+        self._codec = value
+
+    def detect_codec(self):
+        codecs = self.device.passthrough_codecs
+        if not self.passthrough or not codecs:
+            return self.device.codec
+        recorder = codecs[0].get_recorder(self.sink.monitor)
+        process = subprocess.Popen(recorder.command, stdout=subprocess.PIPE)
+        try:
+            data = process.stdout.read(self.PROBE_SIZE)
+        finally:
+            process.kill()
+            process.wait()
+        data_type = pulseaudio_dlna.encoders.iec61937_data_type(data)
+        for codec in codecs:
+            if data_type in codec.DATA_TYPES:
+                logger.info('Detected {} passthrough on "{}".'.format(
+                    codec.IDENTIFIER, self.sink.name))
+                return codec
+        return self.device.codec
 
     def __cmp__(self, other):
         if isinstance(other, PulseBridge):
@@ -574,10 +940,14 @@ class PulseBridge(object):
 class PulseWatcher(PulseAudio):
 
     ASYNC_EXECUTION = True
+    COMMAND_WORKERS = 8
+    RESYNC_INTERVAL = 60
+    DEVICE_BATCH_WINDOW = 0.5
 
     def __init__(self, pulse_queue, stream_queue, disable_switchback=False,
                  disable_device_stop=False, disable_auto_reconnect=True,
-                 cover_mode='application', proc_title=None):
+                 passthrough=False, prewarm=False, cover_mode='application',
+                 proc_title=None):
         PulseAudio.__init__(self)
 
         self.bridges = []
@@ -585,13 +955,21 @@ class PulseWatcher(PulseAudio):
         self.stream_queue = stream_queue
         self.blocked_devices = []
         self.signal_timers = {}
+        self.pending_commands = set()
+        self.deferred_sink_updates = set()
+        self.device_changes = []
+        self.device_batch_timer = None
+        self.pending_sinks = {}
         self.is_terminating = False
+        self.is_resyncing = False
         self.cover_mode = pulseaudio_dlna.covermodes.MODES[cover_mode]()
         self.proc_title = proc_title
 
         self.disable_switchback = disable_switchback
         self.disable_device_stop = disable_device_stop
         self.disable_auto_reconnect = disable_auto_reconnect
+        self.passthrough = passthrough
+        self.prewarm = prewarm
 
     def shutdown(self, signal_number=None, frame=None):
         if not self.is_terminating:
@@ -604,6 +982,7 @@ class PulseWatcher(PulseAudio):
         signal.signal(signal.SIGTERM, self.shutdown)
         if self.proc_title:
             setproctitle.setproctitle(self.proc_title)
+        pulseaudio_dlna.metrics.set_forward_queue(self.stream_queue)
 
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         signals = (
@@ -613,6 +992,10 @@ class PulseWatcher(PulseAudio):
                 self.on_playback_stream_removed),
             ('FallbackSinkUpdated', 'org.PulseAudio.Core1.{}',
                 self.on_fallback_sink_updated),
+            ('NewSink', 'org.PulseAudio.Core1.{}',
+                self.on_new_sink),
+            ('SinkRemoved', 'org.PulseAudio.Core1.{}',
+                self.on_sink_removed),
             ('DeviceUpdated', 'org.PulseAudio.Core1.Stream.{}',
                 self.on_device_updated),
         )
@@ -620,7 +1003,10 @@ class PulseWatcher(PulseAudio):
         self.update()
         self.default_sink = self.fallback_sink
 
-        self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.thread_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.COMMAND_WORKERS)
+        GObject.timeout_add(
+            self.RESYNC_INTERVAL * 1000, self._on_resync)
 
         mainloop = GObject.MainLoop()
         GObject.io_add_watch(
@@ -643,6 +1029,35 @@ class PulseWatcher(PulseAudio):
             getattr(self, message_type)(**message)
         return True
 
+    def _on_resync(self):
+        # The signals keep the sinks and streams up to date, a full update
+        # only catches what was missed. Sinks whose streams changed are
+        # handled as if their signals had arrived.
+        if self.is_resyncing:
+            return True
+        self.is_resyncing = True
+        devices = {
+            path: stream.device for path, stream in self.stream_map.items()}
+
+        def on_update(success):
+            self.is_resyncing = False
+            if not success:
+                return
+            changed_sinks = set()
+            for path, stream in self.stream_map.items():
+                device = devices.pop(path, None)
+                if device != stream.device:
+                    changed_sinks.update([device, stream.device])
+            changed_sinks.update(devices.values())
+            for sink_path in changed_sinks:
+                if sink_path in self.sink_map:
+                    logger.info('Resync found changed streams of "{}".'.format(
+                        sink_path))
+                    self._delayed_handle_sink_update(sink_path)
+
+        self.update_async(on_update)
+        return True
+
     def _block_device_handling(self, object_path):
         self.blocked_devices.append(object_path)
         GObject.timeout_add(1000, self._unblock_device_handling, object_path)
@@ -657,9 +1072,13 @@ class PulseWatcher(PulseAudio):
         })
 
     def cleanup(self):
+        removed_sinks = []
         for bridge in self.bridges:
+            if bridge.sink in removed_sinks:
+                continue
             logger.info('Remove "{}" sink ...'.format(bridge.sink.name))
             self.delete_null_sink(bridge.sink.module.index)
+            removed_sinks.append(bridge.sink)
         self.bridges = []
         sys.exit(0)
 
@@ -726,35 +1145,46 @@ class PulseWatcher(PulseAudio):
         elif len(stopped_bridge.sink.streams) == 0:
             pass
 
-    def on_device_updated(self, sink_path):
+    def on_device_updated(self, sink_path, object_path=None):
         logger.info('on_device_updated "{path}"'.format(
             path=sink_path))
-        self.update()
+        self.move_playback_stream(object_path, sink_path)
         self._delayed_handle_sink_update(sink_path)
 
-    def on_fallback_sink_updated(self, sink_path):
-        self.default_sink = PulseSinkFactory.new(self.bus, sink_path)
-        self.update()
+    def on_fallback_sink_updated(self, sink_path, object_path=None):
+        self.default_sink = self.sink_map.get(sink_path, None)
+        if self.default_sink is None:
 
-    def on_new_playback_stream(self, stream_path):
+            def on_sink(sink):
+                self.default_sink = sink
+
+            self.add_sink_async(sink_path, on_sink)
+
+    def on_new_sink(self, sink_path, object_path=None):
+        logger.info('on_new_sink "{path}"'.format(path=sink_path))
+        if sink_path not in self.sink_map:
+            self.add_sink_async(sink_path)
+
+    def on_sink_removed(self, sink_path, object_path=None):
+        logger.info('on_sink_removed "{path}"'.format(path=sink_path))
+        self.remove_sink(sink_path)
+
+    def on_new_playback_stream(self, stream_path, object_path=None):
         logger.info('on_new_playback_stream "{path}"'.format(
             path=stream_path))
-        self.update()
-        for sink in self.sinks:
-            for stream in sink.streams:
-                if stream.object_path == stream_path:
-                    self._delayed_handle_sink_update(sink.object_path)
-                    return
 
-    def on_playback_stream_removed(self, stream_path):
+        def on_stream(stream):
+            if stream and stream.device in self.sink_map:
+                self._delayed_handle_sink_update(stream.device)
+
+        self.add_playback_stream_async(stream_path, on_stream)
+
+    def on_playback_stream_removed(self, stream_path, object_path=None):
         logger.info('on_playback_stream_removed "{path}"'.format(
             path=stream_path))
-        for sink in self.sinks:
-            for stream in sink.streams:
-                if stream.object_path == stream_path:
-                    self.update()
-                    self._delayed_handle_sink_update(sink.object_path)
-                    return
+        stream = self.remove_playback_stream(stream_path)
+        if stream and stream.device in self.sink_map:
+            self._delayed_handle_sink_update(stream.device)
 
     def _delayed_handle_sink_update(self, sink_path):
         if self.signal_timers.get(sink_path, None):
@@ -763,30 +1193,19 @@ class PulseWatcher(PulseAudio):
             1000, self._handle_sink_update, sink_path)
 
     def _handle_sink_update(self, sink_path):
-        if not self.ASYNC_EXECUTION:
-            logger.info('_sync_handle_sink_update {}'.format(sink_path))
-            result = self.__handle_sink_update(sink_path)
-            logger.info(
-                '_sync_handle_sink_update {} finished!'.format(sink_path))
-        else:
-            logger.info('_async_handle_sink_update {}'.format(sink_path))
-            future = self.thread_pool.submit(
-                self.__handle_sink_update, sink_path)
-            result = future.result()
-            logger.info(
-                '_async_handle_sink_update {} finished!'.format(sink_path))
-        return result
-
-    def __handle_sink_update(self, sink_path):
         if sink_path in self.signal_timers:
             del self.signal_timers[sink_path]
 
         if sink_path in self.blocked_devices:
             logger.info('{sink_path} was blocked!'.format(sink_path=sink_path))
-            return
+            return False
 
         for bridge in self.bridges:
             logger.debug('\n{}'.format(bridge))
+            if bridge.device.udn in self.pending_commands:
+                # Handled again once the device answered.
+                self.deferred_sink_updates.add(sink_path)
+                continue
             if bridge.device.state == bridge.device.STATE_PLAYING:
                 if len(bridge.sink.streams) == 0 and (
                         not self.disable_device_stop and
@@ -794,68 +1213,280 @@ class PulseWatcher(PulseAudio):
                     logger.info(
                         'Instructing the device "{}" to stop ...'.format(
                             bridge.device.label))
-                    return_code, message = bridge.device.stop()
-                    if return_code == 200:
-                        logger.info(
-                            'The device "{}" was stopped.'.format(
-                                bridge.device.label))
-                    else:
-                        if not message:
-                            message = 'Unknown reason.'
-                        logger.error(
-                            'The device "{}" failed to stop! ({}) - {}'.format(
-                                bridge.device.label,
-                                return_code,
-                                message))
-                        self.switch_back(bridge, message)
+                    self._run_command(
+                        bridge, self._on_stop_finished,
+                        self._send_command, bridge, 'stop')
                     continue
-            if bridge.sink.object_path == sink_path:
-                if bridge.device.state == bridge.device.STATE_STOPPED or \
-                   bridge.device.state == bridge.device.STATE_PAUSED:
-                    logger.info(
-                        'Instructing the device "{}" to play ...'.format(
-                            bridge.device.label))
-                    artist, title, thumb = self.cover_mode.get(bridge)
-                    return_code, message = bridge.device.play(
-                        artist=artist, title=title, thumb=thumb)
-                    if return_code == 200:
-                        logger.info(
-                            'The device "{}" is playing.'.format(
-                                bridge.device.label))
-                    else:
-                        if not message:
-                            message = 'Unknown reason.'
-                        logger.error(
-                            'The device "{}" failed to play! ({}) - {}'.format(
-                                bridge.device.label,
-                                return_code,
-                                message))
-                        self.switch_back(bridge, message)
+            if bridge.sink.object_path == sink_path and (
+                    bridge.passthrough or
+                    bridge.device.state == bridge.device.STATE_STOPPED or
+                    bridge.device.state == bridge.device.STATE_PAUSED):
+                artist, title, thumb = self.cover_mode.get(bridge)
+                self._run_command(
+                    bridge, self._on_play_finished,
+                    self._play_bridge, bridge, artist, title, thumb)
         return False
 
+    def _run_command(self, bridge, callback, function, *args):
+        # Devices are commanded from the thread pool, so a slow device does
+        # not hold up the others. The results are handled in the main loop.
+        self.pending_commands.add(bridge.device.udn)
+        if not self.ASYNC_EXECUTION:
+            self._finish_command(bridge, callback, function(*args))
+            return
+        future = self.thread_pool.submit(function, *args)
+        future.add_done_callback(
+            lambda future: GObject.idle_add(
+                self._on_command_done, bridge, callback, future))
+
+    def _on_command_done(self, bridge, callback, future):
+        try:
+            result = future.result()
+        except Exception:
+            logger.error(traceback.format_exc())
+            result = None
+        self._finish_command(bridge, callback, result)
+        return False
+
+    def _finish_command(self, bridge, callback, result):
+        self.pending_commands.discard(bridge.device.udn)
+        if result is not None:
+            callback(bridge, *result)
+        deferred_sink_updates = self.deferred_sink_updates
+        self.deferred_sink_updates = set()
+        for sink_path in deferred_sink_updates:
+            self._delayed_handle_sink_update(sink_path)
+
+    def _play_bridge(self, bridge, artist, title, thumb):
+        codec = None
+        if bridge.device.group:
+            codec = bridge.codec
+        if bridge.passthrough:
+            codec = bridge.detect_codec()
+            if bridge.device.state == bridge.device.STATE_PLAYING \
+               and type(codec) is not type(bridge.codec):
+                logger.info(
+                    'The stream format of "{}" changed.'.format(
+                        bridge.device.label))
+                bridge.device.state = bridge.device.STATE_STOPPED
+            bridge.codec = codec
+        if bridge.device.state != bridge.device.STATE_STOPPED and \
+           bridge.device.state != bridge.device.STATE_PAUSED:
+            return None
+        if self.prewarm or bridge.device.group:
+            self.stream_queue.put({
+                'type': 'prewarm_bridge',
+                'bridge': bridge,
+            })
+        logger.info(
+            'Instructing the device "{}" to play ...'.format(
+                bridge.device.label))
+        self.stream_queue.put({
+            'type': 'register_play',
+            'udn': bridge.device.udn,
+            'timestamp': time.time(),
+        })
+        return self._send_command(
+            bridge, 'play', codec=codec, artist=artist,
+            title=title, thumb=thumb)
+
+    def _on_play_finished(self, bridge, return_code, message):
+        if return_code == 200:
+            logger.info(
+                'The device "{}" is playing.'.format(bridge.device.label))
+        else:
+            if not message:
+                message = 'Unknown reason.'
+            logger.error(
+                'The device "{}" failed to play! ({}) - {}'.format(
+                    bridge.device.label, return_code, message))
+            self.switch_back(bridge, message)
+
+    def _on_stop_finished(self, bridge, return_code, message):
+        if return_code == 200:
+            logger.info(
+                'The device "{}" was stopped.'.format(bridge.device.label))
+        else:
+            if not message:
+                message = 'Unknown reason.'
+            logger.error(
+                'The device "{}" failed to stop! ({}) - {}'.format(
+                    bridge.device.label, return_code, message))
+            self.switch_back(bridge, message)
+
+    def _send_command(self, bridge, command, **kwargs):
+        start_time = time.time()
+        return_code, message = getattr(bridge.device, command)(**kwargs)
+        pulseaudio_dlna.metrics.RENDERER_COMMAND_SECONDS.observe(
+            time.time() - start_time, device=bridge.device.label,
+            command=command, status=return_code)
+        return return_code, message
+
+    def _get_group_bridges(self, group):
+        return [
+            bridge for bridge in self.bridges if bridge.device.group == group]
+
+    def _update_group_codecs(self, group):
+        # The devices of a group can only share the recorder and encoder
+        # pipeline when all of them use the same codec.
+        bridges = self._get_group_bridges(group)
+        identifiers = None
+        for bridge in bridges:
+            available = [
+                codec.IDENTIFIER for codec in bridge.device.codecs
+                if not codec.PASSTHROUGH and codec.enabled and
+                codec.encoder and codec.encoder.available]
+            if identifiers is None:
+                identifiers = available
+            else:
+                identifiers = [
+                    identifier for identifier in identifiers
+                    if identifier in available]
+        for bridge in bridges:
+            bridge.codec = None
+            for codec in bridge.device.codecs:
+                if identifiers and codec.IDENTIFIER == identifiers[0] and \
+                   not codec.PASSTHROUGH:
+                    bridge.codec = codec
+                    break
+        if identifiers:
+            logger.info('The group "{}" is streamed as {}.'.format(
+                group, identifiers[0]))
+        elif bridges:
+            logger.warning(
+                'The devices of the group "{}" have no codec in common, '
+                'they are encoded separately.'.format(group))
+
     def add_device(self, device):
-        sink = self.create_null_sink(
-            device.short_name, device.label)
-        self.bridges.append(PulseBridge(sink, device))
-        self.update()
-        self.share_bridges()
+        self._queue_device_change('add', device)
+
+    def remove_device(self, device):
+        self._queue_device_change('remove', device)
+
+    def _queue_device_change(self, change, device):
+        # Discovery reports devices in bursts. The changes are collected for
+        # a short while, so their sinks are created together and the stream
+        # server gets the bridges once per burst.
+        self.device_changes.append((change, device))
+        if self.device_batch_timer is None:
+            self.device_batch_timer = GObject.timeout_add(
+                int(self.DEVICE_BATCH_WINDOW * 1000), self._on_device_batch)
+
+    def _on_device_batch(self):
+        self.device_batch_timer = None
+        added_devices = collections.OrderedDict()
+        removed_devices = []
+        for change, device in self.device_changes:
+            if change == 'add':
+                added_devices[device.udn] = device
+            elif device.udn in added_devices:
+                del added_devices[device.udn]
+            else:
+                removed_devices.append(device)
+        self.device_changes = []
+
+        changed = False
+        for device in removed_devices:
+            changed = self._remove_device(device) or changed
+        if added_devices:
+            self._add_devices(added_devices.values())
+        elif changed and not self.pending_sinks:
+            self.share_bridges()
+        return False
+
+    def _get_sink_settings(self, device):
+        if device.group:
+            return ('group_{}'.format(
+                re.sub(r'[^a-z0-9]', '', device.group.lower())),
+                device.group, None)
+        passthrough_codecs = device.passthrough_codecs
+        if self.passthrough and passthrough_codecs:
+            return (device.short_name, device.label, max(
+                codec.SAMPLE_RATE for codec in passthrough_codecs))
+        return (device.short_name, device.label, None)
+
+    def _add_devices(self, devices):
+        start_time = time.time()
+        requested_sinks = []
+        for device in devices:
+            if device.group:
+                group_bridges = self._get_group_bridges(device.group)
+                if group_bridges:
+                    self._add_bridge(device, group_bridges[0].sink)
+                    continue
+            sink_name, sink_description, sample_rate = \
+                self._get_sink_settings(device)
+            if sink_name in self.pending_sinks:
+                self.pending_sinks[sink_name].append(device)
+                continue
+            self.pending_sinks[sink_name] = [device]
+            requested_sinks.append((sink_name, sink_description, sample_rate))
+
+        if not self.pending_sinks:
+            self.share_bridges()
+            return
+
+        def on_sink(sink_name, sink):
+            sink_devices = self.pending_sinks.pop(sink_name)
+            if sink and not sink_devices:
+                # All devices of the sink were removed while it was created.
+                self.delete_null_sink(sink.module.index)
+            for device in sink_devices:
+                if sink:
+                    self._add_bridge(device, sink)
+                else:
+                    logger.error(
+                        'Could not create a sink for the device '
+                        '"{name} ({flavour})".'.format(
+                            name=device.name, flavour=device.flavour))
+            if not self.pending_sinks:
+                self.share_bridges()
+                logger.info('Created the sinks of {count} device(s) '
+                            'in {duration:.3f}s.'.format(
+                                count=len(devices),
+                                duration=time.time() - start_time))
+
+        for sink_name, sink_description, sample_rate in requested_sinks:
+            self.create_null_sink_async(
+                sink_name, sink_description,
+                functools.partial(on_sink, sink_name),
+                sample_rate=sample_rate)
+
+    def _add_bridge(self, device, sink):
+        passthrough = bool(
+            self.passthrough and device.passthrough_codecs and
+            not device.group)
+        self.bridges.append(PulseBridge(sink, device, passthrough=passthrough))
+        if device.group:
+            self._update_group_codecs(device.group)
         logger.info('Added the device "{name} ({flavour})".'.format(
             name=device.name, flavour=device.flavour))
 
-    def remove_device(self, device):
+    def _remove_device(self, device):
+        for devices in self.pending_sinks.values():
+            if device in devices:
+                devices.remove(device)
+                return False
+
         bridge_index_to_remove = None
         for index, bridge in enumerate(self.bridges):
             if bridge.device == device:
-                logger.info('Remove "{}" sink ...'.format(bridge.sink.name))
                 bridge_index_to_remove = index
-                self.delete_null_sink(bridge.sink.module.index)
+                shared_sink = any(
+                    other.sink == bridge.sink for other in self.bridges
+                    if other is not bridge)
+                if not shared_sink:
+                    logger.info('Remove "{}" sink ...'.format(
+                        bridge.sink.name))
+                    self.delete_null_sink(bridge.sink.module.index)
                 break
-        if bridge_index_to_remove is not None:
-            self.bridges.pop(bridge_index_to_remove)
-            self.update()
-            self.share_bridges()
-            logger.info('Removed the device "{name}".'.format(
-                name=device.name))
+        if bridge_index_to_remove is None:
+            return False
+        bridge = self.bridges.pop(bridge_index_to_remove)
+        if bridge.device.group:
+            self._update_group_codecs(bridge.device.group)
+        logger.info('Removed the device "{name}".'.format(name=device.name))
+        return True
 
     def update_device(self, device):
         for bridge in self.bridges:
@@ -867,6 +1498,5 @@ class PulseWatcher(PulseAudio):
                     logger.info(
                         'Updated device "{}" - New settings: {}:{}'.format(
                             device.label, device.ip, device.port))
-                    self.update()
                     self.share_bridges()
                     break
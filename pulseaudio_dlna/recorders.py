@@ -17,10 +17,110 @@
 
 from __future__ import unicode_literals
 
+import ctypes
+import ctypes.util
+import logging
+import threading
+
 import pulseaudio_dlna.codecs
 
+logger = logging.getLogger('pulseaudio_dlna.recorders')
+
+BACKENDS = ['parec', 'libpulse']
+BACKEND = 'parec'
+
+PA_SAMPLE_S16LE = 3
+PA_STREAM_RECORD = 2
+PA_INVALID = 0xffffffff
+PA_USEC_INVALID = 0xffffffffffffffff
+
+
+class UnknownBackendException(Exception):
+    def __init__(self, backend):
+        Exception.__init__(
+            self,
+            'You specified an unknown recorder backend "{}"!'.format(backend)
+        )
+
+
+class MissingLibraryException(Exception):
+    def __init__(self, library):
+        Exception.__init__(
+            self,
+            'The library "{}" could not be loaded!'.format(library)
+        )
+
+
+class RecorderException(Exception):
+    def __init__(self, monitor, message):
+        Exception.__init__(
+            self,
+            'Recording from "{}" failed: {}'.format(monitor, message)
+        )
+
+
+def set_backend(backend):
+    global BACKEND
+    if backend not in BACKENDS:
+        raise UnknownBackendException(backend)
+    if backend == 'libpulse':
+        _load_libpulse_simple()
+    BACKEND = backend
+
+
+class _SampleSpec(ctypes.Structure):
+    _fields_ = [
+        ('format', ctypes.c_int),
+        ('rate', ctypes.c_uint32),
+        ('channels', ctypes.c_uint8),
+    ]
+
+
+class _BufferAttr(ctypes.Structure):
+    _fields_ = [
+        ('maxlength', ctypes.c_uint32),
+        ('tlength', ctypes.c_uint32),
+        ('prebuf', ctypes.c_uint32),
+        ('minreq', ctypes.c_uint32),
+        ('fragsize', ctypes.c_uint32),
+    ]
+
+
+_libpulse_simple = None
+
+
+def _load_libpulse_simple():
+    global _libpulse_simple
+    if _libpulse_simple is not None:
+        return _libpulse_simple
+    try:
+        lib = ctypes.CDLL(ctypes.util.find_library('pulse-simple'))
+        lib.pa_simple_new.argtypes = [
+            ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_char_p, ctypes.POINTER(_SampleSpec), ctypes.c_void_p,
+            ctypes.POINTER(_BufferAttr), ctypes.POINTER(ctypes.c_int)]
+        lib.pa_simple_new.restype = ctypes.c_void_p
+        lib.pa_simple_read.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+            ctypes.POINTER(ctypes.c_int)]
+        lib.pa_simple_read.restype = ctypes.c_int
+        lib.pa_simple_free.argtypes = [ctypes.c_void_p]
+        lib.pa_simple_free.restype = None
+        lib.pa_simple_get_latency.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+        lib.pa_simple_get_latency.restype = ctypes.c_uint64
+    except (OSError, TypeError, AttributeError):
+        raise MissingLibraryException('libpulse-simple')
+    _libpulse_simple = lib
+    return lib
+
 
 class BaseRecorder(object):
+
+    IN_PROCESS = False
+    LATENCY = None
+    FRAGMENT_SIZE = None
+
     def __init__(self):
         self._command = []
 
@@ -28,6 +128,9 @@ class BaseRecorder(object):
     def command(self):
         return self._command
 
+    def get_latency(self):
+        return None
+
 
 class PulseaudioRecorder(BaseRecorder):
     def __init__(self, monitor, codec=None):
@@ -54,12 +157,124 @@ class PulseaudioRecorder(BaseRecorder):
             return 'flac'
         return None
 
+    @property
+    def latency_options(self):
+        if self.FRAGMENT_SIZE:
+            return ['--latency={}'.format(self.FRAGMENT_SIZE)]
+        elif self.LATENCY:
+            return ['--latency-msec={}'.format(self.LATENCY)]
+        return []
+
     @property
     def command(self):
         if not self.codec:
-            return super(PulseaudioRecorder, self).command + ['-d', self.monitor]
+            return super(PulseaudioRecorder, self).command + \
+                self.latency_options + ['-d', self.monitor]
         else:
-            return super(PulseaudioRecorder, self).command + [
-                '-d', self.monitor,
-                '--file-format={}'.format(self.file_format),
-            ]
+            return super(PulseaudioRecorder, self).command + \
+                self.latency_options + [
+                    '-d', self.monitor,
+                    '--file-format={}'.format(self.file_format),
+                ]
+
+
+class PassthroughRecorder(PulseaudioRecorder):
+    def __init__(self, monitor):
+        PulseaudioRecorder.__init__(self, monitor)
+        self._command = ['parec', '--format=s16le', '--channels=2',
+                         '--fix-rate']
+
+
+class PulseSimpleRecorder(BaseRecorder):
+
+    IN_PROCESS = True
+    SAMPLE_RATE = 44100
+    CHANNELS = 2
+    DEFAULT_FRAGMENT_SIZE = 4096
+
+    def __init__(self, monitor):
+        BaseRecorder.__init__(self)
+        self._monitor = monitor
+        self._simple = None
+        self._error = None
+        self._buffer = None
+        self._lock = threading.Lock()
+
+    @property
+    def monitor(self):
+        return self._monitor
+
+    @property
+    def fragment_size(self):
+        if self.FRAGMENT_SIZE:
+            return int(self.FRAGMENT_SIZE)
+        elif self.LATENCY:
+            frame_size = self.CHANNELS * 2
+            size = int(self.SAMPLE_RATE * self.LATENCY / 1000) * frame_size
+            return max(size, frame_size)
+        return self.DEFAULT_FRAGMENT_SIZE
+
+    def open(self):
+        lib = _load_libpulse_simple()
+        sample_spec = _SampleSpec(
+            PA_SAMPLE_S16LE, self.SAMPLE_RATE, self.CHANNELS)
+        buffer_attr = _BufferAttr(
+            PA_INVALID, PA_INVALID, PA_INVALID, PA_INVALID,
+            self.fragment_size)
+        error = ctypes.c_int(0)
+        with self._lock:
+            self._simple = lib.pa_simple_new(
+                None, b'pulseaudio-dlna', PA_STREAM_RECORD,
+                self.monitor.encode('utf-8'), b'record',
+                ctypes.byref(sample_spec), None, ctypes.byref(buffer_attr),
+                ctypes.byref(error))
+            if not self._simple:
+                self._error = error.value
+                raise RecorderException(
+                    self.monitor, 'error code {}'.format(error.value))
+            self._error = None
+        logger.info('Recording "{}" with libpulse-simple '
+                    '(fragment size {} bytes).'.format(
+                        self.monitor, self.fragment_size))
+
+    def read(self, size):
+        with self._lock:
+            if self._simple is None:
+                return b''
+            if self._buffer is None or len(self._buffer) != size:
+                self._buffer = ctypes.create_string_buffer(size)
+            error = ctypes.c_int(0)
+            if _libpulse_simple.pa_simple_read(
+                    self._simple, self._buffer, size,
+                    ctypes.byref(error)) < 0:
+                logger.error(RecorderException(
+                    self.monitor, 'error code {}'.format(error.value)))
+                self._error = error.value
+                self._close()
+                return b''
+            return self._buffer.raw
+
+    def get_latency(self):
+        with self._lock:
+            if self._simple is None:
+                return None
+            error = ctypes.c_int(0)
+            latency = _libpulse_simple.pa_simple_get_latency(
+                self._simple, ctypes.byref(error))
+            if latency == PA_USEC_INVALID:
+                return None
+            return latency / 1000000.0
+
+    def poll(self):
+        if self._simple is None:
+            return self._error or 0
+        return None
+
+    def _close(self):
+        if self._simple is not None:
+            _libpulse_simple.pa_simple_free(self._simple)
+            self._simple = None
+
+    def close(self):
+        with self._lock:
+            self._close()
@@ -74,6 +74,10 @@ class FAKE_HTTP_CONTENT_LENGTH(BaseRule):
     pass
 
 
+class CHUNKED_TRANSFER_ENCODING(BaseRule):
+    pass
+
+
 class DISABLE_DEVICE_STOP(BaseRule):
     pass
 
@@ -95,6 +99,15 @@ class REQUEST_TIMEOUT(BaseRule):
             self.__class__.__name__, self.timeout)
 
 
+class PREROLL(BaseRule):
+    def __init__(self, seconds=None):
+        self.seconds = float(seconds if seconds is not None else 1)
+
+    def __str__(self):
+        return '{} (seconds="{}")'.format(
+            self.__class__.__name__, self.seconds)
+
+
 # class EXAMPLE_PROPERTIES_RULE(BaseRule):
 #     def __init__(self, prop1=None, prop2=None):
 #         self.prop1 = prop1 or 'abc'
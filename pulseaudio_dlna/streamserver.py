@@ -36,43 +36,268 @@ import BaseHTTPServer
 import SocketServer
 import Queue
 import threading
+import collections
+import email.utils
+import errno
+import fcntl
+import struct
+import termios
+import cStringIO
+import audioop
+import time
 
 import pulseaudio_dlna.encoders
 import pulseaudio_dlna.codecs
 import pulseaudio_dlna.recorders
 import pulseaudio_dlna.rules
 import pulseaudio_dlna.images
+import pulseaudio_dlna.metrics
+import pulseaudio_dlna.utils.splice
 
 logger = logging.getLogger('pulseaudio_dlna.streamserver')
 
 PROTOCOL_VERSION_V10 = 'HTTP/1.0'
 PROTOCOL_VERSION_V11 = 'HTTP/1.1'
 
+METRICS_PATH = '/metrics'
+
+
+def encode_chunk(data):
+    return b''.join([b'%x\r\n' % len(data), data, b'\r\n'])
+
+LAST_CHUNK = b'0\r\n\r\n'
+
+
+class LatencyProbe(object):
+
+    ENABLED = False
+    STAGES = ['capture', 'encode', 'queue', 'send']
+    WEIGHT = 0.1
+
+    def __init__(self):
+        self.delays = {}
+
+    def add(self, stage, delay):
+        current = self.delays.get(stage, None)
+        if current is None:
+            self.delays[stage] = delay
+        else:
+            self.delays[stage] = current + (delay - current) * self.WEIGHT
+
+    def merge(self, other):
+        delays = dict(other.delays)
+        delays.update(self.delays)
+        return delays
+
+    @classmethod
+    def format(cls, delays):
+        stages = []
+        for stage in cls.STAGES:
+            delay = delays.get(stage, None)
+            stages.append('{} {}'.format(
+                stage,
+                'n/a' if delay is None else '{} ms'.format(int(delay * 1000))))
+        stages.append('total {} ms'.format(
+            int(sum(delays.values()) * 1000)))
+        return ', '.join(stages)
+
 
 class ProcessQueue(Queue.Queue):
 
-    def data(self):
-        data = self.get()
+    POLICY_BLOCK = 'block'
+    POLICY_DROP = 'drop'
+    POLICY_DISCONNECT = 'disconnect'
+    POLICIES = [POLICY_BLOCK, POLICY_DROP, POLICY_DISCONNECT]
+
+    POLICY = POLICY_DROP
+    MAX_DELAY = 5
+
+    def __init__(self, bytes_per_second=None):
+        Queue.Queue.__init__(self)
+        self.max_bytes = int(self.MAX_DELAY * (bytes_per_second or 0))
+        self.bytes = 0
+        self.dropped_bytes = 0
+        self.is_dropping = False
+        self.is_closed = False
+        self.is_overflowed = False
+        self.is_consumed = False
+        self.listener = None
+        self.header_size = 0
+        self.stream_base = None
+        self.sent_bytes = 0
+        self.first_byte_time = None
+        self.put_times = None
+        self.last_put_time = None
+
+    def _put(self, item):
+        self.queue.append(item)
+        self.bytes += len(item)
+        if self.put_times is not None:
+            self.put_times.append(time.time())
+        if self.listener is not None:
+            self.listener()
+
+    def _get(self):
+        item = self.queue.popleft()
+        self.bytes -= len(item)
+        self.is_consumed = True
+        if self.put_times:
+            self.last_put_time = self.put_times.popleft()
+        return item
+
+    def put(self, item, block=True, timeout=None):
+        if len(item) == 0 or self.max_bytes <= 0:
+            return Queue.Queue.put(self, item, block, timeout)
+        with self.not_full:
+            if self.is_closed or self.is_overflowed:
+                return
+            # Under the block policy the producer waits in wait_for_room()
+            # beforehand, put() itself never blocks.
+            if self._has_room(len(item)):
+                self.is_dropping = False
+            elif self.POLICY == self.POLICY_DROP:
+                self._drop(len(item))
+            elif self.POLICY == self.POLICY_DISCONNECT:
+                logger.warning(
+                    'Client is more than {} seconds behind, '
+                    'disconnecting.'.format(self.MAX_DELAY))
+                self.is_overflowed = True
+                self.queue.clear()
+                if self.put_times is not None:
+                    self.put_times.clear()
+                self.bytes = 0
+                item = b''
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _has_room(self, size):
+        return (self.max_bytes <= 0 or self.bytes == 0 or
+                self.bytes + size <= self.max_bytes)
+
+    def wait_for_room(self, size, timeout=None):
+        with self.not_full:
+            if not self._has_room(size) and not self.is_closed:
+                self.not_full.wait(timeout)
+            return (self._has_room(size) or self.is_closed or
+                    self.is_overflowed)
+
+    def _drop(self, size):
+        # Keep the first item until it was consumed, it carries the header
+        # of the stream.
+        index = 0 if self.is_consumed else 1
+        while len(self.queue) > index and self.bytes + size > self.max_bytes:
+            item = self.queue[index]
+            del self.queue[index]
+            if self.put_times:
+                del self.put_times[index]
+            self.bytes -= len(item)
+            self.dropped_bytes += len(item)
+            self.unfinished_tasks -= 1
+        if not self.is_dropping:
+            self.is_dropping = True
+            logger.warning(
+                'Client is more than {} seconds behind, dropping data '
+                '({} bytes dropped so far).'.format(
+                    self.MAX_DELAY, self.dropped_bytes))
+
+    def sent(self, size):
+        if self.first_byte_time is None:
+            self.first_byte_time = time.time()
+        self.sent_bytes += size
+
+    def close(self):
+        with self.not_full:
+            self.is_closed = True
+            self.not_full.notify_all()
+
+    def data(self, block=True):
+        try:
+            data = self.get(block)
+        except Queue.Empty:
+            return None
+        put_time = self.last_put_time
         if not self.empty():
             data = [data]
             while not self.empty():
                 data.append(self.get())
             data = b''.join(data)
+        # The returned data waited as long as its oldest item.
+        self.last_put_time = put_time
         return data
 
 
 class ProcessThread(threading.Thread):
 
-    CHUNK_SIZE = 1024 * 32
-
-    def __init__(self, path, encoder, recorder, queue, *args, **kwargs):
+    CHUNK_SIZE = None
+    MIN_CHUNK_SIZE = 256
+    MAX_CHUNK_SIZE = 1024 * 64
+    READ_LATENCIES = {
+        pulseaudio_dlna.encoders.LATENCY_LOW: 0.02,
+        pulseaudio_dlna.encoders.LATENCY_BALANCED: 0.05,
+        pulseaudio_dlna.encoders.LATENCY_EFFICIENT: 0.25,
+    }
+    HEADER_MAX_SIZE = 1024 * 64
+    SPLICE = True
+    SPLICE_POLL_INTERVAL = 0.1
+    PREROLL = 1
+    REPLAY_SIZE = 0
+    SILENCE_TIMEOUT = None
+    SILENCE_THRESHOLD = 16
+    SILENCE_CAPTURE = 1
+    SILENCE_POLL_INTERVAL = 0.05
+    PCM_FRAME_SIZE = 2 * 2
+    PCM_BYTES_PER_SECOND = 44100 * PCM_FRAME_SIZE
+    PROBE_WINDOW = 30
+
+    def __init__(self, name, encoder, recorder, codec, preroll=None,
+                 backlog_size=0, *args, **kwargs):
         threading.Thread.__init__(self, *args, **kwargs)
-        self.path = path
+        self.name = name
         self.encoder = encoder
         self.recorder = recorder
+        self.codec = codec
         self.recorder_process = None
         self.encoder_process = None
-        self.queue = queue
+
+        self.queues = []
+        self.pending_queues = []
+        self.delayed_queues = []
+        self.lock = threading.Lock()
+        self.splice_queue = None
+        self.splice_fd = None
+        self.splice_stalled_since = None
+
+        self.position = 0
+        self.header = None
+        self.header_pending = False
+        self.stream_start = None
+        self.remainder = b''
+
+        self.backlog = collections.deque()
+        self.backlog_bytes = 0
+        self.backlog_position = 0
+        self.preroll = self.PREROLL if preroll is None else preroll
+        self.backlog_size = backlog_size
+        self.backlog_max_bytes = int(max(
+            self.preroll + backlog_size,
+            self.REPLAY_SIZE) * self.encoder.bytes_per_second)
+
+        self.suspend_on_silence = bool(
+            self.SILENCE_TIMEOUT and self.codec.SILENCE_REPLAY)
+        self.suspended = False
+        self.suspended_since = None
+        self.suspended_time = 0
+        self.silent_duration = 0
+        self.silence_pending = 0
+        self.silent_frame = None
+        self.partial_frame = b''
+
+        self.probe = LatencyProbe() if LatencyProbe.ENABLED else None
+        self.probe_lock = threading.Lock()
+        self.probe_marks = collections.deque()
+        self.probe_pcm_bytes = 0
+        self.probe_encoded_bytes = 0
 
         self.reinitialize_count = 0
         self.stop_event = threading.Event()
@@ -81,6 +306,8 @@ class ProcessThread(threading.Thread):
             10000, self._on_regenerate_reinitialize_count)
 
     def _on_regenerate_reinitialize_count(self):
+        if self.is_stopped:
+            return False
         if self.reinitialize_count > 0:
             self.reinitialize_count -= 1
         return True
@@ -92,29 +319,536 @@ class ProcessThread(threading.Thread):
     def is_stopped(self):
         return self.stop_event.isSet()
 
+    @property
+    def chunk_size(self):
+        if self.CHUNK_SIZE:
+            return self.CHUNK_SIZE
+        latency = self.READ_LATENCIES.get(
+            self.encoder.LATENCY_PROFILE,
+            self.READ_LATENCIES[pulseaudio_dlna.encoders.LATENCY_BALANCED])
+        if isinstance(self.encoder, pulseaudio_dlna.encoders.BuiltinEncoder):
+            # In-process encoders are fed with the chunk read from the
+            # recorder, so it is sized by the PCM input, not the bit rate.
+            size = int(self.PCM_BYTES_PER_SECOND * latency)
+            size -= size % self.PCM_FRAME_SIZE
+        else:
+            size = int(self.encoder.bytes_per_second * latency)
+            size -= size % self.codec.alignment
+        return max(self.MIN_CHUNK_SIZE, min(self.MAX_CHUNK_SIZE, size))
+
+    def add_queue(self, queue, fd=None, preroll=None, delay=0, aligned=False):
+        with self.lock:
+            if fd is not None and not aligned and self._can_splice():
+                logger.info('Splicing the stream of {} to the client.'.format(
+                    self.name))
+                self.splice_queue = queue
+                self.splice_fd = fd
+                self.splice_stalled_since = None
+                return
+            self._stop_splice()
+            if preroll is None:
+                preroll = self.preroll
+            if aligned:
+                # Devices of a group must start exactly their offset behind
+                # the live position. Like queues waiting for the header, the
+                # queue waits until the backlog covers that offset.
+                self.delayed_queues.append((queue, min(
+                    preroll + delay,
+                    self.backlog_max_bytes /
+                    float(self.encoder.bytes_per_second))))
+                self._release_delayed_queues()
+            elif self.stream_start is None:
+                self.queues.append(queue)
+            else:
+                self._put_header(queue)
+                # Joining clients get the recent audio at once, so devices
+                # which buffer before playing start sooner.
+                if preroll + delay > 0 and self.backlog and \
+                   not self.header_pending and \
+                   self._put_backlog(queue, preroll + delay):
+                    self.queues.append(queue)
+                else:
+                    self.pending_queues.append(queue)
+
+    def remove_queue(self, queue):
+        with self.lock:
+            for queues in [self.queues, self.pending_queues]:
+                if queue in queues:
+                    queues.remove(queue)
+            self.delayed_queues = [
+                (delayed_queue, duration)
+                for delayed_queue, duration in self.delayed_queues
+                if delayed_queue is not queue]
+            if queue is self.splice_queue:
+                self.splice_queue = None
+                self.splice_fd = None
+            return self.queue_count
+
+    @property
+    def queue_count(self):
+        return (len(self.queues) + len(self.pending_queues) +
+                len(self.delayed_queues) +
+                int(self.splice_queue is not None))
+
+    def _can_splice(self):
+        return (
+            self.SPLICE and
+            not self.suspend_on_silence and
+            self.probe is None and
+            not self.REPLAY_SIZE and
+            not self.backlog_size and
+            not self.preroll and
+            pulseaudio_dlna.utils.splice.is_available() and
+            not isinstance(
+                self.encoder, pulseaudio_dlna.encoders.BuiltinEncoder) and
+            self.stream_start is None and
+            self.splice_queue is None and
+            not self.queues and not self.pending_queues and
+            not self.delayed_queues)
+
+    def _stop_splice(self):
+        if self.splice_queue is not None:
+            logger.info('Stopped splicing the stream of {}.'.format(
+                self.name))
+            self.queues.append(self.splice_queue)
+            self.splice_queue = None
+            self.splice_fd = None
+
+    def _close_splice(self):
+        if self.splice_queue is not None:
+            self.splice_queue.put(b'')
+            self.splice_queue = None
+            self.splice_fd = None
+
+    def _write_splice(self, data):
+        try:
+            while len(data) > 0:
+                data = data[os.write(self.splice_fd, data):]
+        except OSError:
+            self._close_splice()
+
+    def splice(self, fd):
+        with self.lock:
+            splice_fd = self.splice_fd
+        if splice_fd is None:
+            return
+        # Waiting is bounded, so a client joining meanwhile stops the
+        # splicing within the poll interval.
+        r, w, e = select.select([fd], [], [], self.SPLICE_POLL_INTERVAL)
+        if not r:
+            return
+        r, w, e = select.select([], [splice_fd], [], self.SPLICE_POLL_INTERVAL)
+        if not w:
+            self._check_splice_stall(splice_fd)
+            return
+        self.splice_stalled_since = None
+        # The socket is switched to non-blocking only for the call, the
+        # stream thread writes to it blocking once the queue takes over.
+        flags = fcntl.fcntl(splice_fd, fcntl.F_GETFL)
+        fcntl.fcntl(splice_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        error = None
+        try:
+            size = pulseaudio_dlna.utils.splice.splice(
+                fd, splice_fd, self.chunk_size,
+                pulseaudio_dlna.utils.splice.SPLICE_F_MOVE |
+                pulseaudio_dlna.utils.splice.SPLICE_F_MORE |
+                pulseaudio_dlna.utils.splice.SPLICE_F_NONBLOCK)
+        except OSError as e:
+            error = e
+        fcntl.fcntl(splice_fd, fcntl.F_SETFL, flags)
+        if error is not None:
+            if error.errno not in [errno.EAGAIN, errno.EINTR]:
+                with self.lock:
+                    if self.splice_fd == splice_fd:
+                        self._close_splice()
+            return
+        with self.lock:
+            if self.stream_start is None:
+                self.stream_start = self.position
+            self.position += size
+            if self.splice_queue is not None:
+                self.splice_queue.sent(size)
+
+    def _check_splice_stall(self, splice_fd):
+        # A client which takes no data for longer than the queue's delay
+        # budget is handed to its queue, which then applies the buffer
+        # policy instead of holding back the encoder.
+        now = time.time()
+        if self.splice_stalled_since is None:
+            self.splice_stalled_since = now
+        elif now - self.splice_stalled_since > ProcessQueue.MAX_DELAY:
+            with self.lock:
+                if self.splice_fd == splice_fd:
+                    logger.info(
+                        'The client of {} stalled for {} seconds.'.format(
+                            self.name, ProcessQueue.MAX_DELAY))
+                    self._stop_splice()
+
+    def _reset_stream(self):
+        with self.lock:
+            self.header = b''
+            self.header_pending = bool(self.encoder.writes_header)
+            self.stream_start = None
+            self.queues.extend(self.pending_queues)
+            self.pending_queues = []
+            self.backlog.clear()
+            self.backlog_bytes = 0
+            self.remainder = b''
+            self.partial_frame = b''
+            self.silence_pending = 0
+
+    def _align(self, data):
+        # Reads return whatever the pipe holds, so PCM data is cut back to
+        # whole sample frames. Dropping a chunk then never splits a frame.
+        alignment = self.codec.alignment
+        if alignment <= 1 or self.header_pending or self.stream_start is None:
+            return data
+        data = self.remainder + data
+        end = self.position + len(data) - self.stream_start
+        size = len(data) - end % alignment
+        self.remainder = data[size:]
+        return data[:size]
+
+    def _append_backlog(self, data):
+        if not self.backlog:
+            self.backlog_position = self.position
+        self.backlog.append(data)
+        self.backlog_bytes += len(data)
+        while self.backlog_bytes - len(self.backlog[0]) >= \
+                self.backlog_max_bytes:
+            chunk = self.backlog.popleft()
+            self.backlog_bytes -= len(chunk)
+            self.backlog_position += len(chunk)
+
+    def _put_header(self, queue):
+        if self.header and not self.header_pending:
+            queue.put(self.header)
+            queue.header_size = len(self.header)
+
+    def _release_delayed_queues(self):
+        if not self.delayed_queues or self.header_pending or \
+           self.stream_start is None:
+            return
+        available = 0
+        if self.backlog:
+            available = self.position - max(
+                self.stream_start, self.backlog_position)
+        waiting = []
+        for queue, duration in self.delayed_queues:
+            if available < int(duration * self.encoder.bytes_per_second):
+                waiting.append((queue, duration))
+                continue
+            self._put_header(queue)
+            if duration > 0 and self._put_backlog(queue, duration):
+                self.queues.append(queue)
+            else:
+                self.pending_queues.append(queue)
+        self.delayed_queues = waiting
+
+    def _put_backlog(self, queue, duration):
+        size = int(duration * self.encoder.bytes_per_second)
+        start = max(self.stream_start, self.backlog_position,
+                    self.position - size)
+        data = b''.join(self.backlog)[start - self.backlog_position:]
+        offset = self.codec.frame_start(data, start - self.stream_start)
+        if offset is None:
+            return False
+        queue.stream_base = start + offset
+        if len(data) > offset:
+            queue.put(data[offset:])
+        return True
+
+    @property
+    def replay_window(self):
+        with self.lock:
+            if not self.backlog:
+                return None
+            return self.backlog_position, self.position
+
+    def resume_queue(self, queue, position):
+        with self.lock:
+            if not self.backlog or \
+               not self.backlog_position <= position <= self.position:
+                return False
+            data = b''.join(self.backlog)[position - self.backlog_position:]
+            if len(data) > 0:
+                queue.put(data)
+            self.queues.append(queue)
+            return True
+
+    def _resolve_header(self, data):
+        self.header += data
+        size = self.codec.header_size(self.header)
+        if size is not None and size <= len(self.header):
+            self.header = self.header[:size]
+        elif len(self.header) < self.HEADER_MAX_SIZE:
+            return
+        self.header_pending = False
+        self.stream_start = self.stream_start + len(self.header)
+        for queue in self.pending_queues:
+            queue.put(self.header)
+            queue.header_size = len(self.header)
+
+    def _sync_pending_queues(self, data):
+        offset = self.codec.frame_start(
+            data, self.position - self.stream_start)
+        if offset is None:
+            return
+        data = data[offset:]
+        for queue in self.pending_queues:
+            queue.stream_base = self.position + offset
+            if len(data) > 0:
+                queue.put(data)
+            self.queues.append(queue)
+        self.pending_queues = []
+
+    def _wait_for_queues(self, size):
+        # Slow clients hold back the pipeline under the block policy. They
+        # are waited for without holding the lock, so the other clients of
+        # the pipeline can still attach and detach meanwhile.
+        with self.lock:
+            queues = list(self.queues)
+        for queue in queues:
+            while not queue.wait_for_room(size, timeout=1):
+                if self.is_stopped:
+                    return
+
+    def publish(self, data):
+        if ProcessQueue.POLICY == ProcessQueue.POLICY_BLOCK:
+            self._wait_for_queues(len(data))
+        with self.lock:
+            if self.stream_start is None:
+                self.stream_start = self.position
+            for queue in self.queues:
+                if queue.stream_base is None:
+                    queue.stream_base = self.position
+                queue.put(data)
+            if self.splice_fd is not None:
+                self._write_splice(data)
+            if self.header_pending:
+                self._resolve_header(data)
+            elif self.pending_queues and self.position >= self.stream_start:
+                self._sync_pending_queues(data)
+            if self.backlog_max_bytes > 0:
+                self._append_backlog(data)
+            self.position += len(data)
+            self._release_delayed_queues()
+
+    def _probe_capture(self, size):
+        # Remembers when each recorded byte was read, the encoder output is
+        # mapped back to those offsets by its bit rate.
+        now = time.time()
+        with self.probe_lock:
+            self.probe_pcm_bytes += size
+            self.probe_marks.append((self.probe_pcm_bytes, now))
+            while now - self.probe_marks[0][1] > self.PROBE_WINDOW:
+                self.probe_marks.popleft()
+        latency = self.recorder.get_latency()
+        if latency is not None:
+            self.probe.add('capture', latency)
+
+    def _probe_encode(self, size):
+        read_time = None
+        with self.probe_lock:
+            self.probe_encoded_bytes += size
+            pcm_bytes = (
+                self.probe_encoded_bytes * self.PCM_BYTES_PER_SECOND /
+                float(self.encoder.bytes_per_second))
+            while self.probe_marks and self.probe_marks[0][0] <= pcm_bytes:
+                read_time = self.probe_marks.popleft()[1]
+        if read_time is not None:
+            self.probe.add('encode', time.time() - read_time)
+
+    def _reset_probe(self):
+        with self.probe_lock:
+            self.probe_marks.clear()
+            self.probe_pcm_bytes = 0
+            self.probe_encoded_bytes = 0
+
+    def _suspend(self):
+        self.suspended = True
+        self.suspended_since = time.time()
+        logger.info(
+            'Suspended the encoder of {} after {} seconds of silence.'.format(
+                self.name, int(self.silent_duration)))
+
+    def _resume(self):
+        self.suspended = False
+        suspended_time = time.time() - self.suspended_since
+        self.suspended_time += suspended_time
+        pulseaudio_dlna.metrics.ENCODER_SUSPENDED_SECONDS.inc(
+            suspended_time, sink=self.name, codec=self.codec.IDENTIFIER)
+        with self.lock:
+            self.silence_pending = 0
+        logger.info(
+            'Resumed the encoder of {} after {:.1f} seconds.'.format(
+                self.name, suspended_time))
+
+    def _at_frame_boundary(self):
+        return not self.partial_frame and not self.remainder
+
+    def _check_silence(self, data):
+        # Returns whether the recorded data still has to be encoded. While
+        # the encoder is suspended the silence is only accounted for and
+        # replayed from a previously encoded frame.
+        size = len(data) - len(data) % 2
+        duration = float(len(data)) / self.PCM_BYTES_PER_SECOND
+        if audioop.rms(data[:size], 2) > self.SILENCE_THRESHOLD:
+            self.silent_duration = 0
+            if self.suspended:
+                self._resume()
+            return True
+        self.silent_duration += duration
+        if not self.suspended:
+            if self.silent_duration >= self.SILENCE_TIMEOUT and \
+               self.silent_frame is not None:
+                self._suspend()
+            return True
+        if not self._at_frame_boundary():
+            return True
+        with self.lock:
+            self.silence_pending += duration
+        return False
+
+    def _publish_frames(self, data):
+        data, self.partial_frame = self.codec.split_frames(
+            self.partial_frame + data)
+        if len(data) == 0:
+            return
+        if self.silent_duration >= self.SILENCE_CAPTURE and \
+           not self.header_pending:
+            self.silent_frame = (
+                self.codec.silent_frame(data) or self.silent_frame)
+        self.publish(data)
+
+    def _replay_silence(self):
+        if not self._at_frame_boundary():
+            return
+        frame, duration = self.silent_frame
+        with self.lock:
+            count = int(self.silence_pending / duration)
+            self.silence_pending -= count * duration
+        if count > 0:
+            self.publish(frame * count)
+
+    def close_queues(self):
+        with self.lock:
+            for queue in self.queues + self.pending_queues + [
+                    queue for queue, duration in self.delayed_queues]:
+                queue.put(b'')
+            self._close_splice()
+            # Nothing can be resumed from a stopped pipeline.
+            self.backlog.clear()
+            self.backlog_bytes = 0
+
     def run(self):
 
-        def create_processes():
-            logger.info('Starting processes "{recorder} | {encoder}"'.format(
-                recorder=' '.join(self.recorder.command),
-                encoder=' '.join(self.encoder.command)))
+        def feed_encoder(read, read_size, pipe):
+            try:
+                while True:
+                    data = read(read_size)
+                    if len(data) == 0:
+                        break
+                    if self.probe is not None:
+                        self._probe_capture(len(data))
+                    if self.suspend_on_silence and \
+                       not self._check_silence(data):
+                        continue
+                    pipe.write(data)
+            except IOError:
+                pass
+            finally:
+                try:
+                    pipe.close()
+                except IOError:
+                    pass
+
+        def create_recorder():
+            if self.recorder.IN_PROCESS:
+                try:
+                    self.recorder.open()
+                except pulseaudio_dlna.recorders.RecorderException as e:
+                    logger.error(e)
+                return self.recorder, self.recorder.read
             rec_process = subprocess.Popen(
                 self.recorder.command,
-                stdout=subprocess.PIPE)
-            enc_process = subprocess.Popen(
-                self.encoder.command,
-                stdin=rec_process.stdout,
                 stdout=subprocess.PIPE,
                 bufsize=-1)
-            rec_process.stdout.close()
-            return rec_process, enc_process, enc_process.stdout.read
+            rec_fd = rec_process.stdout.fileno()
+            return rec_process, lambda size: os.read(rec_fd, size)
 
-        def do_processes_respond(rec_process, enc_process):
-            return (rec_process.poll() is None and
-                    enc_process.poll() is None)
+        def create_processes():
+            if self.probe is not None:
+                self._reset_probe()
+            recorder_name = ' '.join(self.recorder.command) or \
+                self.recorder.__class__.__name__
+            if isinstance(
+                    self.encoder, pulseaudio_dlna.encoders.BuiltinEncoder):
+                logger.info('Starting process "{recorder}" ({encoder})'.format(
+                    recorder=recorder_name,
+                    encoder=self.encoder.__class__.__name__))
+                rec_process, rec_read = create_recorder()
+                self.encoder.reset()
+                self._reset_stream()
+                self.encoder_process = None
+                encode = self.encoder.encode
+
+                def read(size):
+                    data = rec_read(size)
+                    if self.probe is not None and len(data) > 0:
+                        self._probe_capture(len(data))
+                    if self.suspend_on_silence and len(data) > 0 and \
+                       not self._check_silence(data):
+                        return b''
+                    return encode(data)
+                return [rec_process], read
+
+            logger.info('Starting processes "{recorder} | {encoder}"'.format(
+                recorder=recorder_name,
+                encoder=' '.join(self.encoder.command)))
+            if self.recorder.IN_PROCESS or self.suspend_on_silence or \
+               self.probe is not None:
+                rec_process, rec_read = create_recorder()
+                enc_process = subprocess.Popen(
+                    self.encoder.command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    bufsize=-1)
+                read_size = (
+                    self.recorder.fragment_size if self.recorder.IN_PROCESS
+                    else int(self.recorder.FRAGMENT_SIZE or 4096))
+                feeder = threading.Thread(
+                    target=feed_encoder,
+                    args=(rec_read, read_size, enc_process.stdin))
+                feeder.daemon = True
+                feeder.start()
+            else:
+                rec_process = subprocess.Popen(
+                    self.recorder.command,
+                    stdout=subprocess.PIPE)
+                enc_process = subprocess.Popen(
+                    self.encoder.command,
+                    stdin=rec_process.stdout,
+                    stdout=subprocess.PIPE,
+                    bufsize=-1)
+                rec_process.stdout.close()
+            self._reset_stream()
+            self.encoder_process = enc_process
+            enc_fd = enc_process.stdout.fileno()
+            return ([rec_process, enc_process],
+                    lambda size: os.read(enc_fd, size))
+
+        def do_processes_respond(processes):
+            for process in processes:
+                if process.poll() is not None:
+                    return False
+            return True
 
         def terminate_processes(processes):
             for process in processes:
+                if isinstance(process, pulseaudio_dlna.recorders.BaseRecorder):
+                    process.close()
+                    continue
                 pid = process.pid
                 logger.debug('Terminating process {} ...'.format(pid))
                 try:
@@ -126,22 +860,26 @@ class ProcessThread(threading.Thread):
                     except:
                         pass
 
-        chunk_size = self.CHUNK_SIZE
-        queue = self.queue
+        chunk_size = self.chunk_size
+        publish = self.publish
+        splice = self.splice
+        align = self._align
 
-        rec_process, enc_process, enc_read = create_processes()
+        processes, enc_read = create_processes()
         logger.info(
-            'Processes of {path} initialized ...'.format(
-                path=self.path))
+            'Processes of {name} initialized (read size {size} bytes) '
+            '...'.format(name=self.name, size=chunk_size))
         while not self.is_stopped:
-            if not do_processes_respond(rec_process, enc_process):
+            if not do_processes_respond(processes):
                 if self.reinitialize_count < 3:
                     self.reinitialize_count += 1
-                    terminate_processes([rec_process, enc_process])
-                    rec_process, enc_process, enc_read = create_processes()
+                    pulseaudio_dlna.metrics.ENCODER_RESTARTS.inc(
+                        sink=self.name, codec=self.codec.IDENTIFIER)
+                    terminate_processes(processes)
+                    processes, enc_read = create_processes()
                     logger.info(
-                        'Processes of {path} reinitialized ...'.format(
-                            path=self.path))
+                        'Processes of {name} reinitialized ...'.format(
+                            name=self.name))
                 else:
                     logger.error(
                         'There were more than {} attempts to reinitialize '
@@ -149,52 +887,135 @@ class ProcessThread(threading.Thread):
                             self.reinitialize_count))
                     break
 
-            data = enc_read(chunk_size)
+            if self.splice_fd is not None and not self.header_pending:
+                splice(processes[-1].stdout.fileno())
+                continue
+
+            if self.suspend_on_silence:
+                if self.suspended:
+                    self._replay_silence()
+                if self.encoder_process is not None:
+                    r, w, e = select.select(
+                        [self.encoder_process.stdout], [], [],
+                        self.SILENCE_POLL_INTERVAL)
+                    if not r:
+                        continue
+                data = align(enc_read(chunk_size))
+                if len(data) > 0:
+                    if self.probe is not None:
+                        self._probe_encode(len(data))
+                    self._publish_frames(data)
+                continue
+
+            data = align(enc_read(chunk_size))
             if len(data) > 0:
-                queue.put(data)
-
-        terminate_processes([rec_process, enc_process])
-        queue.put(b'')
+                if self.probe is not None:
+                    self._probe_encode(len(data))
+                publish(data)
+
+        self.stop()
+        terminate_processes(processes)
+        self.close_queues()
+        if self.suspended:
+            self._resume()
+        if self.suspended_time > 0:
+            logger.info(
+                'The encoder of {} was suspended for {} seconds.'.format(
+                    self.name, int(self.suspended_time)))
 
 
 class ProcessStream(object):
 
     RUNNING = True
+    PROBE_INTERVAL = 5
 
-    def __init__(self, path, sock, recorder, encoder, bridge):
+    def __init__(self, path, sock, bridge, chunked=False, queue=None):
         self.path = path
         self.sock = sock
-        self.recorder = recorder
-        self.encoder = encoder
         self.bridge = bridge
+        self.chunked = chunked
+        self.queue = queue or ProcessQueue(
+            bridge.codec.encoder.bytes_per_second)
+        self.play_time = None
+        self.reported_sent_bytes = 0
+        self.reported_dropped_bytes = 0
+        self.process_thread = None
+
+        self.probe = None
+        self.probe_report_time = None
+        if LatencyProbe.ENABLED:
+            self.probe = LatencyProbe()
+            self.probe_report_time = time.time() + self.PROBE_INTERVAL
+            if self.queue.put_times is None:
+                self.queue.put_times = collections.deque()
 
         self.id = hex(id(self))
 
-    def run(self):
+    def probe_queue(self):
+        if self.queue.last_put_time is not None:
+            self.probe.add('queue', time.time() - self.queue.last_put_time)
 
-        queue = ProcessQueue()
-        process_thread = ProcessThread(
-            self.path, self.encoder, self.recorder, queue)
-        process_thread.daemon = True
-        process_thread.start()
+    def probe_send(self, send_time):
+        # Data in the socket's send buffer has not reached the device yet.
+        try:
+            unsent_bytes = struct.unpack(b'i', fcntl.ioctl(
+                self.sock.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+        except (IOError, socket.error):
+            unsent_bytes = 0
+        now = time.time()
+        self.probe.add('send', now - send_time + unsent_bytes / float(
+            self.bridge.codec.encoder.bytes_per_second))
+        if now >= self.probe_report_time:
+            self.probe_report_time = now + self.PROBE_INTERVAL
+            self.report_latency()
+
+    def report_latency(self):
+        delays = self.probe.delays
+        if self.process_thread is not None and \
+           self.process_thread.probe is not None:
+            delays = self.probe.merge(self.process_thread.probe)
+        logger.info('Latency of "{}" ({}): {}'.format(
+            self.bridge.device.label, self.bridge.codec.IDENTIFIER,
+            LatencyProbe.format(delays)))
+
+    @property
+    def metric_labels(self):
+        return {
+            'device': self.bridge.device.label,
+            'codec': self.bridge.codec.IDENTIFIER,
+        }
 
+    def run(self):
         empty_list = []
         select_select = select.select
         sock = self.sock
         sock_list = [self.sock]
         sock_sendall = self.sock.sendall
         sock_recv = self.sock.recv
-        queue_data = queue.data
+        queue_data = self.queue.data
+        queue_sent = self.queue.sent
+        chunked = self.chunked
+        probe = self.probe
 
         while self.RUNNING:
             r, w, e = select_select(sock_list, sock_list, empty_list, 0)
 
             if sock in w:
                 data = queue_data()
-                if len(data) == 0:
-                    break
                 try:
+                    if len(data) == 0:
+                        if chunked:
+                            sock_sendall(LAST_CHUNK)
+                        break
+                    if chunked:
+                        data = encode_chunk(data)
+                    if probe is not None:
+                        self.probe_queue()
+                        send_time = time.time()
                     sock_sendall(data)
+                    queue_sent(len(data))
+                    if probe is not None:
+                        self.probe_send(send_time)
                 except socket.error:
                     break
 
@@ -206,8 +1027,6 @@ class ProcessStream(object):
                 except socket.error:
                     break
 
-        process_thread.stop()
-
     def __str__(self):
         return '<{} id="{}">\n'.format(
             self.__class__.__name__,
@@ -219,23 +1038,270 @@ class StreamManager(object):
     def __init__(self, server):
         self.streams = {}
         self.timeouts = {}
+        self.pipelines = {}
+        self.resume_points = {}
+        self.play_requests = {}
+        self.lock = threading.Lock()
         self.server = server
 
-    def create_stream(self, path, request, bridge):
+    def create_stream(self, path, request, bridge, chunked=False,
+                      resume=None):
+        stream, process_thread = self.open_stream(
+            path, request, bridge, chunked=chunked, resume=resume)
+        try:
+            stream.run()
+        finally:
+            self.close_stream(stream, process_thread)
+
+    def open_stream(self, path, request, bridge, splice=True, chunked=False,
+                    resume=None):
         stream = ProcessStream(
             path=path,
             sock=request,
-            recorder=bridge.device.codec.get_recorder(bridge.sink.monitor),
-            encoder=bridge.device.codec.encoder,
             bridge=bridge,
+            chunked=chunked,
+            queue=resume[1] if resume else None,
         )
         self.register(stream)
-        stream.run()
+        stream.process_thread = self.attach(
+            stream, splice=splice and not chunked, resume=resume)
+        return stream, stream.process_thread
+
+    def close_stream(self, stream, process_thread):
+        stream.queue.close()
+        self._report_stream(stream)
+        if stream.probe is not None:
+            stream.report_latency()
+        if process_thread.REPLAY_SIZE and stream.queue.dropped_bytes == 0 and \
+           stream.queue.stream_base is not None and \
+           not process_thread.is_stopped:
+            self.resume_points[stream.path] = (
+                process_thread, stream.queue.header_size,
+                stream.queue.stream_base)
+        self.detach(stream, process_thread)
+        if stream.queue.dropped_bytes > 0:
+            logger.info('Dropped {} bytes for stream "{}" ({}).'.format(
+                stream.queue.dropped_bytes, stream.path, stream.id))
         self.unregister(stream)
 
+    PREWARM_TIMEOUT = 30
+
+    def _create_pipeline(self, bridge):
+        codec = bridge.codec
+        recorder = codec.get_recorder(bridge.sink.monitor)
+        encoder = codec.encoder
+        key = (type(recorder).__name__, bridge.sink.monitor,
+               tuple(recorder.command), str(encoder), tuple(encoder.command))
+        return key, codec, recorder, encoder
+
+    def _remove_pipeline(self, process_thread):
+        process_thread.stop()
+        for key, pipeline in self.pipelines.items():
+            if pipeline is process_thread:
+                del self.pipelines[key]
+        for path, resume_point in self.resume_points.items():
+            if resume_point[0] is process_thread:
+                del self.resume_points[path]
+
+    def _get_group_delay(self, bridge):
+        # The devices of a group are started behind the live position by
+        # the time the slowest device of the group lags behind them. The
+        # pipeline keeps a backlog of the largest latency for that.
+        group = bridge.device.group
+        if not group:
+            return 0, 0
+        max_latency = max([
+            other.device.latency for other in self.server.bridges
+            if other.device.group == group] + [bridge.device.latency])
+        return max_latency - bridge.device.latency, max_latency
+
+    def _get_sink_preroll(self, bridge):
+        # A pipeline keeps the largest pre-roll of the devices on its sink.
+        return max([
+            other.device.PREROLL for other in self.server.bridges
+            if other.sink == bridge.sink] + [bridge.device.PREROLL])
+
+    def _get_stream_preroll(self, bridge):
+        # The devices of a group share one pre-roll, only their latencies
+        # offset them against each other.
+        if bridge.device.group:
+            return self._get_sink_preroll(bridge)
+        return bridge.device.PREROLL
+
+    def prewarm(self, bridge):
+        key, codec, recorder, encoder = self._create_pipeline(bridge)
+        delay, backlog_size = self._get_group_delay(bridge)
+        with self.lock:
+            process_thread = self.pipelines.get(key, None)
+            if process_thread is not None and not process_thread.is_stopped:
+                return
+            process_thread = ProcessThread(
+                bridge.sink.monitor, encoder, recorder, codec,
+                preroll=self._get_sink_preroll(bridge),
+                backlog_size=backlog_size)
+            process_thread.daemon = True
+            process_thread.start()
+            self.pipelines[key] = process_thread
+            logger.info('Prewarmed pipeline for "{}" ({}).'.format(
+                bridge.sink.monitor, codec.IDENTIFIER))
+        GObject.timeout_add(
+            self.PREWARM_TIMEOUT * 1000, self._on_prewarm_timeout,
+            process_thread)
+
+    def _on_prewarm_timeout(self, process_thread):
+        with self.lock:
+            if process_thread.queue_count == 0 and \
+               not process_thread.is_stopped:
+                logger.info('Prewarmed pipeline for "{}" was not used.'.format(
+                    process_thread.name))
+                self._remove_pipeline(process_thread)
+        return False
+
+    def _get_resume_point(self, path, offset):
+        process_thread, header_size, stream_base = self.resume_points.get(
+            path, (None, 0, None))
+        if process_thread is not None and process_thread.is_stopped:
+            del self.resume_points[path]
+            return None, None
+        if process_thread is None or offset < header_size:
+            return None, None
+        return process_thread, stream_base + offset - header_size
+
+    def check_range(self, path, offset, reserve=False):
+        # With reserve set, a queue is resumed at the position right away.
+        # The replay window then cannot move past it while the headers are
+        # sent, the queue is handed to the stream once it is opened.
+        with self.lock:
+            process_thread, position = self._get_resume_point(path, offset)
+            if process_thread is None:
+                return 200, None
+            window = process_thread.replay_window
+            if window is None or position < window[0]:
+                return 200, None
+            if position > window[1]:
+                return 416, None
+            if not reserve:
+                return 206, None
+            header_size, stream_base = self.resume_points[path][1:]
+            queue = ProcessQueue(process_thread.encoder.bytes_per_second)
+            if LatencyProbe.ENABLED:
+                queue.put_times = collections.deque()
+            queue.header_size = header_size
+            queue.stream_base = stream_base
+            if not process_thread.resume_queue(queue, position):
+                return 200, None
+            logger.info('Resumed stream "{}" at byte {}.'.format(
+                path, offset))
+            return 206, (process_thread, queue)
+
+    def release_range(self, resume):
+        process_thread, queue = resume
+        queue.close()
+        self._detach_queue(queue, process_thread)
+
+    def attach(self, stream, splice=True, resume=None):
+        key, codec, recorder, encoder = self._create_pipeline(stream.bridge)
+        delay, backlog_size = self._get_group_delay(stream.bridge)
+        preroll = self._get_stream_preroll(stream.bridge)
+        aligned = bool(stream.bridge.device.group)
+        if resume is not None:
+            # The queue of a resumed stream is already fed by its pipeline.
+            # If the pipeline stopped meanwhile the queue was closed, which
+            # closes the connection.
+            return resume[0]
+        with self.lock:
+            process_thread = self.pipelines.get(key, None)
+            if process_thread is None or process_thread.is_stopped:
+                process_thread = ProcessThread(
+                    stream.bridge.sink.monitor, encoder, recorder, codec,
+                    preroll=self._get_sink_preroll(stream.bridge),
+                    backlog_size=backlog_size)
+                process_thread.daemon = True
+                process_thread.add_queue(
+                    stream.queue, stream.sock.fileno() if splice else None,
+                    preroll=preroll, delay=delay, aligned=aligned)
+                process_thread.start()
+                self.pipelines[key] = process_thread
+                logger.info('Created pipeline for "{}" ({}).'.format(
+                    stream.bridge.sink.monitor, codec.IDENTIFIER))
+            else:
+                logger.info('Sharing pipeline of "{}" ({}).'.format(
+                    stream.bridge.sink.monitor, codec.IDENTIFIER))
+                process_thread.add_queue(
+                    stream.queue, preroll=preroll, delay=delay,
+                    aligned=aligned)
+            if aligned:
+                logger.info(
+                    'The stream of "{}" is delayed by {} seconds to match '
+                    'its group, it starts once the backlog covers '
+                    'that.'.format(stream.bridge.device.label, delay))
+        return process_thread
+
+    def detach(self, stream, process_thread):
+        self._detach_queue(stream.queue, process_thread)
+
+    def _detach_queue(self, queue, process_thread):
+        with self.lock:
+            if process_thread.remove_queue(queue) == 0:
+                # Devices often reconnect right away, the pipeline lingers
+                # to give them their pre-roll or to resume their range.
+                linger_time = max(
+                    process_thread.REPLAY_SIZE, process_thread.preroll)
+                if linger_time:
+                    GObject.timeout_add(
+                        int(linger_time * 1000),
+                        self._on_linger_timeout, process_thread)
+                else:
+                    self._remove_pipeline(process_thread)
+
+    def _on_linger_timeout(self, process_thread):
+        with self.lock:
+            if process_thread.queue_count == 0 and \
+               not process_thread.is_stopped:
+                self._remove_pipeline(process_thread)
+        return False
+
+    def register_play(self, udn, timestamp):
+        self.play_requests[udn] = timestamp
+
+    def _report_stream(self, stream):
+        queue = stream.queue
+        labels = stream.metric_labels
+        if stream.play_time is not None and \
+           queue.first_byte_time is not None:
+            pulseaudio_dlna.metrics.PLAY_TO_FIRST_BYTE_SECONDS.observe(
+                max(0, queue.first_byte_time - stream.play_time), **labels)
+            stream.play_time = None
+        sent_bytes = queue.sent_bytes
+        pulseaudio_dlna.metrics.STREAM_SENT_BYTES.inc(
+            sent_bytes - stream.reported_sent_bytes, **labels)
+        stream.reported_sent_bytes = sent_bytes
+        dropped_bytes = queue.dropped_bytes
+        pulseaudio_dlna.metrics.STREAM_DROPPED_BYTES.inc(
+            dropped_bytes - stream.reported_dropped_bytes, **labels)
+        stream.reported_dropped_bytes = dropped_bytes
+
+    def collect_metrics(self):
+        pulseaudio_dlna.metrics.ACTIVE_STREAMS.clear()
+        pulseaudio_dlna.metrics.QUEUE_BYTES.clear()
+        active_streams = collections.Counter()
+        for path, streams in list(self.streams.items()):
+            for stream in list(streams.values()):
+                self._report_stream(stream)
+                labels = stream.metric_labels
+                active_streams[(labels['device'], labels['codec'])] += 1
+                pulseaudio_dlna.metrics.QUEUE_BYTES.set(
+                    stream.queue.bytes, stream=stream.id, **labels)
+        for (device, codec), count in active_streams.items():
+            pulseaudio_dlna.metrics.ACTIVE_STREAMS.set(
+                count, device=device, codec=codec)
+
     def register(self, stream):
         logger.info('Registered stream "{}" ({}) ...'.format(
             stream.path, stream.id))
+        stream.play_time = self.play_requests.pop(
+            stream.bridge.device.udn, None)
+        pulseaudio_dlna.metrics.STREAMS.inc(**stream.metric_labels)
         if not self.streams.get(stream.path, None):
             self.streams[stream.path] = {}
         self.streams[stream.path][stream.id] = stream
@@ -273,28 +1339,76 @@ class StreamManager(object):
 
 
 class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = PROTOCOL_VERSION_V11
+    timeout = 15
+
+    IMAGE_MAX_AGE = 3600
+
     def __init__(self, *args):
+        self.chunked = False
+        self.range_resume = None
         try:
             BaseHTTPServer.BaseHTTPRequestHandler.__init__(self, *args)
         except IOError:
             pass
+        finally:
+            # The range was reserved, but its stream was never opened.
+            if self.range_resume is not None:
+                self.server.stream_manager.release_range(self.range_resume)
 
     def do_HEAD(self):
         logger.debug('Got the following HEAD request:\n{header}'.format(
             header=json.dumps(self.headers.items(), indent=2)))
+        if self.path == METRICS_PATH:
+            self.handle_metrics()
+            return
         item = self.get_requested_item()
         self.handle_headers(item)
 
     def do_GET(self):
         logger.debug('Got the following GET request:\n{header}'.format(
             header=json.dumps(self.headers.items(), indent=2)))
+        if self.path == METRICS_PATH:
+            self.handle_metrics()
+            return
         item = self.get_requested_item()
-        self.handle_headers(item)
+        if self.handle_headers(item) in [304, 404, 416]:
+            return
         if isinstance(item, pulseaudio_dlna.images.BaseImage):
             self.wfile.write(item.data)
         elif isinstance(item, pulseaudio_dlna.pulseaudio.PulseBridge):
-            self.server.stream_manager.create_stream(
-                self.path, self.request, item)
+            self.handle_stream(item)
+            self.close_connection = 1
+
+    def handle_metrics(self):
+        self.server.stream_manager.collect_metrics()
+        data = pulseaudio_dlna.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', pulseaudio_dlna.metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        if self.command == 'GET':
+            self.wfile.write(data)
+
+    def handle_stream(self, bridge):
+        self.wfile.flush()
+        self.request.settimeout(None)
+        resume, self.range_resume = self.range_resume, None
+        self.server.stream_manager.create_stream(
+            self.path, self.request, bridge, chunked=self.chunked,
+            resume=resume)
+
+    def send_not_found(self):
+        # Unlike send_error() this announces the length of the body instead
+        # of closing the connection, so it can be kept alive.
+        content = b'File not found\n'
+        self.send_response(404)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', len(content))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
 
     def handle_headers(self, item):
         response_code = 200
@@ -302,25 +1416,43 @@ class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         if not item:
             logger.info('Requested file not found "{}"'.format(self.path))
-            self.send_error(404, 'File not found: %s' % self.path)
-            return
+            self.send_not_found()
+            return 404
         elif isinstance(item, pulseaudio_dlna.images.BaseImage):
             image = item
-            headers['Content-Type'] = image.content_type
+            headers['ETag'] = image.etag
+            headers['Last-Modified'] = email.utils.formatdate(
+                image.last_modified, usegmt=True)
+            headers['Cache-Control'] = 'max-age={}'.format(
+                self.IMAGE_MAX_AGE)
+            if image.etag in [
+                    etag.strip() for etag in
+                    self.headers.get('if-none-match', '').split(',')]:
+                response_code = 304
+            else:
+                headers['Content-Type'] = image.content_type
+                headers['Content-Length'] = len(image.data)
         elif isinstance(item, pulseaudio_dlna.pulseaudio.PulseBridge):
             bridge = item
-            headers['Content-Type'] = bridge.device.codec.specific_mime_type
+            headers['Content-Type'] = bridge.codec.specific_mime_type
 
             if self.server.fake_http_content_length or \
                pulseaudio_dlna.rules.FAKE_HTTP_CONTENT_LENGTH in \
-               bridge.device.codec.rules:
+               bridge.codec.rules:
                 gb_in_bytes = pow(1024, 3)
                 headers['Content-Length'] = gb_in_bytes * 100
             else:
                 if self.request_version == PROTOCOL_VERSION_V10:
                     pass
                 elif self.request_version == PROTOCOL_VERSION_V11:
-                    headers['Connection'] = 'close'
+                    if pulseaudio_dlna.rules.CHUNKED_TRANSFER_ENCODING in \
+                       bridge.codec.rules or \
+                       pulseaudio_dlna.rules.CHUNKED_TRANSFER_ENCODING in \
+                       bridge.device.rules:
+                        headers['Transfer-Encoding'] = 'chunked'
+                        self.chunked = True
+                    elif self.command == 'GET':
+                        headers['Connection'] = 'close'
 
             if self.headers.get('range'):
                 match = re.search(
@@ -328,7 +1460,17 @@ class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 if match:
                     start_range = int(match.group(1))
                     if start_range != 0:
-                        response_code = 206
+                        response_code, self.range_resume = \
+                            self.server.stream_manager.check_range(
+                                self.path, start_range,
+                                reserve=self.command == 'GET')
+                    if response_code == 206:
+                        self.handle_range_headers(headers, start_range)
+                    elif response_code == 416:
+                        headers = {
+                            'Content-Range': 'bytes */*',
+                            'Content-Length': 0,
+                        }
 
             if isinstance(
                 bridge.device,
@@ -347,12 +1489,33 @@ class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         for name, value in headers.items():
             self.send_header(name, value)
         self.end_headers()
+        return response_code
+
+    def handle_range_headers(self, headers, start_range):
+        # Live streams have no length, the range ends with the fake content
+        # length which is also used when the length is not sent at all.
+        content_length = headers.get('Content-Length', None)
+        end_range = (content_length or pow(1024, 3) * 100) - 1
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start_range, end_range, content_length or '*')
+        if content_length:
+            headers['Content-Length'] = content_length - start_range
 
     def get_requested_item(self):
+        bridge = self.server.routes.get(self.path, None)
+        if bridge is not None:
+            return bridge
         settings = self._decode_settings(self.path)
         if settings.get('type', None) == 'bridge':
             for bridge in self.server.bridges:
                 if settings.get('udn') == bridge.device.udn:
+                    if settings.get('codec', None):
+                        for codec in bridge.device.passthrough_codecs:
+                            if codec.IDENTIFIER == settings['codec']:
+                                return pulseaudio_dlna.pulseaudio.PulseBridge(
+                                    bridge.sink, bridge.device,
+                                    passthrough=True, codec=codec)
+                        return None
                     return bridge
         elif settings.get('type', None) == 'image':
             image_name = settings.get('name', None)
@@ -361,9 +1524,8 @@ class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                     'pulseaudio_dlna.streamserver', os.path.join(
                         'images', os.path.basename(image_name)))
                 try:
-                    _type = pulseaudio_dlna.images.get_type_by_filepath(
-                        image_path)
-                    return _type(path=image_path, cached=True)
+                    return pulseaudio_dlna.images.\
+                        get_cached_image_by_filepath(image_path)
                 except (pulseaudio_dlna.images.UnknownImageExtension,
                         pulseaudio_dlna.images.ImageNotAccessible,
                         pulseaudio_dlna.images.MissingDependencies,
@@ -373,7 +1535,7 @@ class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             icon_name = settings.get('name', None)
             if icon_name:
                 try:
-                    return pulseaudio_dlna.images.get_icon_by_name(
+                    return pulseaudio_dlna.images.get_cached_icon_by_name(
                         os.path.basename(icon_name), size=512)
                 except (pulseaudio_dlna.images.UnknownImageExtension,
                         pulseaudio_dlna.images.ImageNotAccessible,
@@ -389,7 +1551,7 @@ class StreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             settings = {
                 k: v for k, v in re.findall('(.*?)="(.*?)",?', data_string)
             }
-            logger.info(
+            logger.debug(
                 'URL settings: {path} ({data_string})'.format(
                     path=path,
                     data_string=data_string))
@@ -418,6 +1580,7 @@ class StreamServer(SocketServer.TCPServer):
         self.fake_http_content_length = fake_http_content_length
         self.proc_title = proc_title
         self.bridges = []
+        self.routes = {}
 
     def run(self):
         self.allow_reuse_address = True
@@ -439,6 +1602,31 @@ class StreamServer(SocketServer.TCPServer):
 
     def update_bridges(self, bridges):
         self.bridges = bridges
+        self.routes = self._create_routes(bridges)
+
+    def _create_routes(self, bridges):
+        # Maps the exact paths handed out to the devices to their bridges.
+        # The URL settings are only decoded for paths missing here.
+        routes = {}
+        for bridge in bridges:
+            device = bridge.device
+            for codec in device.codecs:
+                if not codec.PASSTHROUGH:
+                    routes[device.get_stream_path(codec)] = bridge
+            for codec in device.passthrough_codecs:
+                routes[device.get_stream_path(codec)] = \
+                    pulseaudio_dlna.pulseaudio.PulseBridge(
+                        bridge.sink, device, passthrough=True, codec=codec)
+        return routes
+
+    def prewarm_bridge(self, bridge):
+        self.stream_manager.prewarm(bridge)
+
+    def register_play(self, udn, timestamp):
+        self.stream_manager.register_play(udn, timestamp)
+
+    def record_metric(self, name, method, value, labels):
+        pulseaudio_dlna.metrics.record(name, method, value, labels)
 
 
 class GobjectMainLoopMixin:
@@ -488,3 +1676,239 @@ class GobjectMainLoopMixin:
 class ThreadedStreamServer(
         GobjectMainLoopMixin, SocketServer.ThreadingMixIn, StreamServer):
     pass
+
+
+class BufferedRequestHandler(StreamRequestHandler):
+    def __init__(self, data, *args):
+        self.data = data
+        self.bridge = None
+        self.resume = None
+        StreamRequestHandler.__init__(self, *args)
+
+    def setup(self):
+        self.connection = self.request
+        self.rfile = cStringIO.StringIO(self.data)
+        self.wfile = cStringIO.StringIO()
+
+    def handle(self):
+        # The buffer holds a single request. Reading another one would hit
+        # its end and mark the connection to be closed.
+        self.close_connection = 1
+        self.handle_one_request()
+
+    def finish(self):
+        pass
+
+    def handle_stream(self, bridge):
+        self.bridge = bridge
+        self.resume, self.range_resume = self.range_resume, None
+
+
+class StreamConnection(object):
+
+    MAX_REQUEST_SIZE = 1024 * 64
+    TIMEOUT = StreamRequestHandler.timeout
+
+    def __init__(self, server, sock, client_address):
+        self.server = server
+        self.sock = sock
+        self.client_address = client_address
+        self.request_data = b''
+        self.buffer = b''
+        self.stream = None
+        self.process_thread = None
+        self.chunked = False
+        self.keep_alive = False
+        self.is_streaming = False
+        self.is_closed = False
+
+        self.sock.setblocking(0)
+        self.read_watch = GObject.io_add_watch(
+            self.sock, GObject.IO_IN | GObject.IO_PRI | GObject.IO_ERR |
+            GObject.IO_HUP, self._on_readable)
+        self.write_watch = None
+        self.timeout_id = None
+        self._reset_timeout()
+
+    def _reset_timeout(self):
+        # Like the threaded server, idle connections and incomplete requests
+        # are closed after a while. Streaming connections are not affected.
+        if self.timeout_id is not None:
+            GObject.source_remove(self.timeout_id)
+        self.timeout_id = GObject.timeout_add(
+            self.TIMEOUT * 1000, self._on_timeout)
+
+    def _on_timeout(self):
+        self.timeout_id = None
+        if self.stream is None:
+            logger.debug('Closing idle connection of {}.'.format(
+                self.client_address[0]))
+            self.close()
+        return False
+
+    def _on_readable(self, sock, condition):
+        if condition & (GObject.IO_ERR | GObject.IO_HUP):
+            self.close()
+            return False
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                return True
+            data = b''
+        if len(data) == 0:
+            self.close()
+            return False
+        if self.request_data is None:
+            return True
+        self._reset_timeout()
+        self.request_data += data
+        if len(self.buffer) == 0:
+            self._handle_request()
+        return not self.is_closed
+
+    def _handle_request(self):
+        index = self.request_data.find(b'\r\n\r\n')
+        if index == -1:
+            if len(self.request_data) > self.MAX_REQUEST_SIZE:
+                self.close()
+            return
+        index += 4
+        handler = BufferedRequestHandler(
+            self.request_data[:index], self.sock, self.client_address,
+            self.server)
+        self.request_data = self.request_data[index:]
+        self.buffer = handler.wfile.getvalue()
+        self.keep_alive = not handler.close_connection
+        if handler.bridge is not None:
+            self.request_data = None
+            self.chunked = handler.chunked
+            self.stream, self.process_thread = \
+                self.server.stream_manager.open_stream(
+                    handler.path, self.sock, handler.bridge, splice=False,
+                    chunked=self.chunked, resume=handler.resume)
+            self.stream.queue.listener = lambda: self.server.wakeup(self)
+            self.server.connections.add(self)
+        self.flush()
+
+    def _on_writable(self, sock, condition):
+        self.flush()
+        if self.is_closed or len(self.buffer) == 0:
+            self.write_watch = None
+            return False
+        return True
+
+    def flush(self):
+        while not self.is_closed:
+            if len(self.buffer) == 0:
+                if self.stream is None:
+                    if not self.keep_alive:
+                        self.close()
+                    elif self.request_data:
+                        self._handle_request()
+                    return
+                data = self.stream.queue.data(block=False)
+                if data is None:
+                    return
+                if len(data) == 0:
+                    self._close_stream()
+                    self.keep_alive = False
+                    if not self.chunked:
+                        self.close()
+                        return
+                    data = LAST_CHUNK
+                elif self.chunked:
+                    data = encode_chunk(data)
+                if self.stream is not None and self.stream.probe is not None:
+                    self.stream.probe_queue()
+                self.buffer = data
+                self.is_streaming = True
+            try:
+                size = self.sock.send(self.buffer)
+            except socket.error as e:
+                if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    self.close()
+                    return
+                size = 0
+            self.buffer = self.buffer[size:]
+            if size > 0 and self.is_streaming and self.stream is not None:
+                self.stream.queue.sent(size)
+                if self.stream.probe is not None:
+                    self.stream.probe_send(time.time())
+            if len(self.buffer) > 0:
+                if self.write_watch is None:
+                    self.write_watch = GObject.io_add_watch(
+                        self.sock, GObject.IO_OUT, self._on_writable)
+                return
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for watch in [self.read_watch, self.write_watch, self.timeout_id]:
+            if watch is not None:
+                GObject.source_remove(watch)
+        self.read_watch = self.write_watch = self.timeout_id = None
+        self._close_stream()
+        self.server.shutdown_request(self.sock)
+
+    def _close_stream(self):
+        if self.stream is not None:
+            self.server.connections.discard(self)
+            self.server.stream_manager.close_stream(
+                self.stream, self.process_thread)
+            self.stream = None
+
+
+class MainLoopStreamServer(GobjectMainLoopMixin, StreamServer):
+
+    def __init__(self, *args, **kwargs):
+        StreamServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+        self.ready_connections = set()
+        self.wakeup_lock = threading.Lock()
+        self.wakeup_reader = None
+        self.wakeup_writer = None
+
+    def serve_forever(self, poll_interval=0.5):
+        self.wakeup_reader, self.wakeup_writer = os.pipe()
+        for fd in [self.wakeup_reader, self.wakeup_writer]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+        GObject.io_add_watch(
+            self.wakeup_reader, GObject.IO_IN, self._on_wakeup)
+        GobjectMainLoopMixin.serve_forever(self, poll_interval)
+
+    def process_request(self, request, client_address):
+        StreamConnection(self, request, client_address)
+
+    def wakeup(self, connection):
+        # Called from the pipeline threads whenever a client's queue gets
+        # data, the main loop then writes it to the client's socket.
+        with self.wakeup_lock:
+            wakeup_pending = bool(self.ready_connections)
+            self.ready_connections.add(connection)
+        if not wakeup_pending:
+            try:
+                os.write(self.wakeup_writer, b'\0')
+            except OSError:
+                pass
+
+    def _on_wakeup(self, fd, condition):
+        try:
+            os.read(self.wakeup_reader, 4096)
+        except OSError:
+            pass
+        with self.wakeup_lock:
+            ready_connections = self.ready_connections
+            self.ready_connections = set()
+        for connection in ready_connections:
+            if connection in self.connections and \
+               connection.write_watch is None:
+                connection.flush()
+        return True
+
+
+SERVER_MODES = {
+    'threaded': ThreadedStreamServer,
+    'mainloop': MainLoopStreamServer,
+}
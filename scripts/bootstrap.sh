@@ -78,7 +78,6 @@ function install_dev() {
         python-lxml \
         python-zeroconf \
         vorbis-tools \
-        sox \
         lame \
         flac \
         opus-tools \
@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the D-Bus round trips and the time of a full update of the sinks
+and playback streams.
+
+A stand-in for pulseaudio's D-Bus interface is started in a separate
+process. It serves the given amount of sinks and streams and counts the
+property requests it answers. The update is measured once with a single
+Get per property and no shared clients or modules (the former behaviour)
+and once with one GetAll per object and the per-update cache.
+
+Usage:
+    dbus-update-benchmark.py [--sinks <sinks>] [--streams <streams>]
+                             [--clients <clients>] [--runs <runs>]
+                             [--debug]
+
+Options:
+    --sinks=<sinks>                Set the number of sinks [default: 20].
+    --streams=<streams>            Set the number of playback streams [default: 50].
+    --clients=<clients>            Set the number of clients the streams belong to [default: 10].
+    --runs=<runs>                  Set the number of updates per mode [default: 10].
+    --debug                        Enable debug mode.
+'''
+
+from __future__ import unicode_literals
+
+from gi.repository import GObject
+
+import dbus
+import dbus.mainloop.glib
+import dbus.server
+import dbus.service
+import docopt
+import logging
+import multiprocessing
+import time
+
+import pulseaudio_dlna.pulseaudio
+
+logger = logging.getLogger('dbus-update-benchmark')
+
+CORE_PATH = '/org/pulseaudio/core1'
+BENCHMARK_INTERFACE = 'org.PulseAudio.Benchmark'
+
+# The properties the factories used to request one by one.
+LEGACY_PROPERTIES = {
+    'org.PulseAudio.Core1.Client': ['PropertyList', 'Index'],
+    'org.PulseAudio.Core1.Module': ['Index', 'Name'],
+    'org.PulseAudio.Core1.Device': [
+        'PropertyList', 'OwnerModule', 'Index', 'Name'],
+    'org.PulseAudio.Core1.Stream': ['Client', 'Index', 'Device'],
+}
+
+
+def property_list(properties):
+    return dbus.Dictionary({
+        key: dbus.Array(
+            [dbus.Byte(ord(c)) for c in value + '\0'], signature='y')
+        for key, value in properties.items()
+    }, signature='say')
+
+
+class StandInObject(dbus.service.Object):
+
+    calls = 0
+
+    def __init__(self, interface, properties):
+        dbus.service.Object.__init__(self)
+        self.interface = interface
+        self.properties = properties
+
+    @dbus.service.method(
+        dbus.PROPERTIES_IFACE, in_signature='ss', out_signature='v')
+    def Get(self, interface, name):
+        StandInObject.calls += 1
+        return self.properties[name]
+
+    @dbus.service.method(
+        dbus.PROPERTIES_IFACE, in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        StandInObject.calls += 1
+        return dbus.Dictionary(self.properties, signature='sv')
+
+    @dbus.service.method(
+        BENCHMARK_INTERFACE, in_signature='', out_signature='u')
+    def TakeCalls(self):
+        calls = StandInObject.calls
+        StandInObject.calls = 0
+        return calls
+
+
+def create_objects(sinks, streams, clients):
+    objects = {}
+    sink_paths = []
+    stream_paths = []
+    for index in range(sinks):
+        module_path = '/org/pulseaudio/core1/module{}'.format(index)
+        objects[module_path] = StandInObject(
+            'org.PulseAudio.Core1.Module', {
+                'Index': dbus.UInt32(index),
+                'Name': 'module-null-sink',
+                'Arguments': dbus.Dictionary({}, signature='ss'),
+                'UsageCounter': dbus.UInt32(0),
+                'PropertyList': property_list({}),
+            })
+        sink_path = '/org/pulseaudio/core1/sink{}'.format(index)
+        objects[sink_path] = StandInObject(
+            'org.PulseAudio.Core1.Device', {
+                'Index': dbus.UInt32(index),
+                'Name': 'sink{}'.format(index),
+                'Driver': 'module-null-sink.c',
+                'OwnerModule': dbus.ObjectPath(module_path),
+                'SampleFormat': dbus.UInt32(3),
+                'SampleRate': dbus.UInt32(44100),
+                'Channels': dbus.Array(
+                    [dbus.UInt32(0), dbus.UInt32(1)], signature='u'),
+                'Volume': dbus.Array(
+                    [dbus.UInt32(65536), dbus.UInt32(65536)], signature='u'),
+                'Mute': dbus.Boolean(False),
+                'PropertyList': property_list({
+                    'device.description': 'Sink {}'.format(index),
+                    'device.class': 'abstract',
+                }),
+            })
+        sink_paths.append(dbus.ObjectPath(sink_path))
+    for index in range(clients):
+        client_path = '/org/pulseaudio/core1/client{}'.format(index)
+        objects[client_path] = StandInObject(
+            'org.PulseAudio.Core1.Client', {
+                'Index': dbus.UInt32(index),
+                'Driver': 'protocol-native.c',
+                'PropertyList': property_list({
+                    'application.name': 'Client {}'.format(index),
+                    'application.icon_name': 'audio-x-generic',
+                    'application.process.binary': 'client{}'.format(index),
+                }),
+            })
+    for index in range(streams):
+        stream_path = '/org/pulseaudio/core1/playback_stream{}'.format(index)
+        objects[stream_path] = StandInObject(
+            'org.PulseAudio.Core1.Stream', {
+                'Index': dbus.UInt32(index),
+                'Driver': 'protocol-native.c',
+                'Client': dbus.ObjectPath(
+                    '/org/pulseaudio/core1/client{}'.format(index % clients)),
+                'Device': sink_paths[index % sinks],
+                'SampleFormat': dbus.UInt32(3),
+                'SampleRate': dbus.UInt32(44100),
+                'Volume': dbus.Array(
+                    [dbus.UInt32(65536), dbus.UInt32(65536)], signature='u'),
+                'Mute': dbus.Boolean(False),
+                'PropertyList': property_list({
+                    'media.name': 'Stream {}'.format(index),
+                }),
+            })
+        stream_paths.append(dbus.ObjectPath(stream_path))
+    objects[CORE_PATH] = StandInObject(
+        'org.PulseAudio.Core1', {
+            'Sinks': dbus.Array(sink_paths, signature='o'),
+            'PlaybackStreams': dbus.Array(stream_paths, signature='o'),
+        })
+    return objects
+
+
+def serve(address_queue, sinks, streams, clients):
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    objects = create_objects(sinks, streams, clients)
+
+    def on_connection_added(connection):
+        for path, obj in objects.items():
+            obj.add_to_connection(connection, path)
+
+    server = dbus.server.Server('unix:tmpdir=/tmp')
+    server.on_connection_added.append(on_connection_added)
+    address_queue.put(server.address)
+    GObject.MainLoop().run()
+
+
+def get_properties_legacy(cls, obj, interface):
+    return {
+        name: obj.Get(interface, name, dbus_interface=dbus.PROPERTIES_IFACE)
+        for name in LEGACY_PROPERTIES[interface]
+    }
+
+
+def measure(pulse, runs, legacy):
+    factory = pulseaudio_dlna.pulseaudio.PulseBaseFactory
+    get_properties = factory.__dict__['_get_properties']
+    if legacy:
+        factory._get_properties = classmethod(get_properties_legacy)
+    take_calls = pulse.core.get_dbus_method(
+        'TakeCalls', BENCHMARK_INTERFACE)
+    durations = []
+    calls = []
+    try:
+        for _ in range(runs):
+            take_calls()
+            cache = None if legacy else {}
+            start_time = time.time()
+            pulse.update_playback_streams(cache)
+            pulse.update_sinks(cache)
+            durations.append(time.time() - start_time)
+            calls.append(take_calls())
+    finally:
+        factory._get_properties = get_properties
+    return durations, calls
+
+
+def main(options):
+    level = logging.DEBUG if options['--debug'] else logging.WARNING
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s %(name)-46s %(levelname)-8s %(message)s',
+        datefmt='%m-%d %H:%M:%S')
+
+    sinks = int(options['--sinks'])
+    streams = int(options['--streams'])
+    clients = int(options['--clients'])
+    runs = int(options['--runs'])
+
+    address_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(address_queue, sinks, streams, clients))
+    process.daemon = True
+    process.start()
+    try:
+        pulse = pulseaudio_dlna.pulseaudio.PulseAudio()
+        pulse.bus = dbus.connection.Connection(address_queue.get())
+        pulse.core = pulse.bus.get_object(object_path=CORE_PATH)
+
+        print('{} sinks, {} streams of {} clients, {} updates per mode'.format(
+            sinks, streams, clients, runs))
+        for mode, legacy in [('get', True), ('getall', False)]:
+            durations, calls = measure(pulse, runs, legacy)
+            print('{mode}: {calls} round trips per update, '
+                  'min {min:.4f}s, avg {avg:.4f}s, max {max:.4f}s'.format(
+                      mode=mode,
+                      calls=max(calls),
+                      min=min(durations),
+                      avg=sum(durations) / len(durations),
+                      max=max(durations)))
+    finally:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main(docopt.docopt(__doc__))
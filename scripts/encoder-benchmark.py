@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compares the in-process pyav encoders with the ffmpeg subprocess encoders.
+A generated sine wave is encoded and the time until the first encoded byte,
+the wall clock time and the CPU time are reported for both backends.
+
+Usage:
+    encoder-benchmark.py [--codec <codec>] [--seconds <seconds>]
+                         [--chunk-size <chunk-size>] [--debug]
+
+Options:
+    --codec=<codec>                Set the codec to benchmark [default: mp3].
+    --seconds=<seconds>            Set the amount of audio to encode [default: 60].
+    --chunk-size=<chunk-size>      Set the size of the PCM chunks [default: 4096].
+    --debug                        Enable debug mode.
+'''
+
+from __future__ import unicode_literals
+
+import array
+import docopt
+import logging
+import math
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import pulseaudio_dlna.codecs
+import pulseaudio_dlna.encoders
+
+logger = logging.getLogger('encoder-benchmark')
+
+SAMPLE_RATE = 44100
+
+
+def generate_pcm(seconds, frequency=440.0):
+    period = array.array(b'h')
+    samples_per_period = int(SAMPLE_RATE / frequency)
+    for index in range(samples_per_period):
+        value = int(16000 * math.sin(2 * math.pi * index / samples_per_period))
+        period.extend([value, value])
+    periods = int(seconds * SAMPLE_RATE / samples_per_period)
+    return period.tostring() * periods
+
+
+def chunks(data, chunk_size):
+    for index in range(0, len(data), chunk_size):
+        yield data[index:index + chunk_size]
+
+
+def cpu_time(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def benchmark_subprocess(encoder, pcm, chunk_size):
+    def feed(pipe):
+        for chunk in chunks(pcm, chunk_size):
+            pipe.write(chunk)
+        pipe.close()
+
+    cpu_start = cpu_time(resource.RUSAGE_CHILDREN)
+    start_time = time.time()
+    process = subprocess.Popen(
+        encoder.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    feeder = threading.Thread(target=feed, args=(process.stdin, ))
+    feeder.daemon = True
+    feeder.start()
+
+    first_byte = None
+    size = 0
+    while True:
+        data = process.stdout.read(chunk_size)
+        if len(data) == 0:
+            break
+        if first_byte is None:
+            first_byte = time.time() - start_time
+        size += len(data)
+    process.wait()
+    duration = time.time() - start_time
+    cpu = cpu_time(resource.RUSAGE_CHILDREN) - cpu_start
+    return first_byte, duration, cpu, size
+
+
+def benchmark_inprocess(encoder, pcm, chunk_size):
+    cpu_start = cpu_time(resource.RUSAGE_SELF)
+    start_time = time.time()
+    encoder.reset()
+
+    first_byte = None
+    size = 0
+    for chunk in chunks(pcm, chunk_size):
+        data = encoder.encode(chunk)
+        if first_byte is None and len(data) > 0:
+            first_byte = time.time() - start_time
+        size += len(data)
+    duration = time.time() - start_time
+    cpu = cpu_time(resource.RUSAGE_SELF) - cpu_start
+    return first_byte, duration, cpu, size
+
+
+def main(options):
+    level = logging.DEBUG if options['--debug'] else logging.WARNING
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s %(name)-46s %(levelname)-8s %(message)s',
+        datefmt='%m-%d %H:%M:%S')
+
+    codec_type = pulseaudio_dlna.codecs.CODECS.get(options['--codec'], None)
+    if codec_type is None:
+        print('Unknown codec "{}"!'.format(options['--codec']))
+        sys.exit(1)
+
+    seconds = float(options['--seconds'])
+    chunk_size = int(options['--chunk-size'])
+    pcm = generate_pcm(seconds)
+
+    for backend, benchmark in [('ffmpeg', benchmark_subprocess),
+                               ('pyav', benchmark_inprocess)]:
+        encoder_type = codec_type.ENCODERS.get(backend, None)
+        if encoder_type is None:
+            print('{}: the codec is not supported'.format(backend))
+            continue
+        codec = codec_type()
+        codec.BACKEND = backend
+        encoder = codec.encoder
+        if not encoder.validate():
+            print('{}: {} is not available'.format(backend, encoder))
+            continue
+        first_byte, duration, cpu, size = benchmark(encoder, pcm, chunk_size)
+        print('{backend}: first byte after {first_byte:.3f}s, '
+              '{seconds:.0f}s of audio in {duration:.3f}s '
+              '({cpu:.3f}s CPU, {size} bytes)'.format(
+                  backend=backend,
+                  first_byte=first_byte or 0,
+                  seconds=seconds,
+                  duration=duration,
+                  cpu=cpu,
+                  size=size))
+
+
+if __name__ == '__main__':
+    main(docopt.docopt(__doc__))
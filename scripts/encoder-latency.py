@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the delay the encoders add for each latency profile.
+
+Silence is fed to the encoder in real time and a single impulse is
+injected. The encoded stream is decoded again with ffmpeg and the time
+between writing the impulse and reading it back is reported. The sample
+offset of the decoded impulse is reported as well, since it shows the
+algorithmic delay of the codec apart from buffering.
+
+Usage:
+    encoder-latency.py [--backend <backend>] [--codecs <codecs>]
+                       [--profiles <profiles>] [--debug]
+
+Options:
+    --backend=<backend>            Set the encoder backend [default: ffmpeg].
+    --codecs=<codecs>              Set the codecs to measure [default: mp3,aac,ogg,flac,opus,wav].
+    --profiles=<profiles>          Set the profiles to measure [default: low,balanced,efficient].
+    --debug                        Enable debug mode.
+'''
+
+from __future__ import unicode_literals
+
+import array
+import docopt
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pulseaudio_dlna.codecs
+import pulseaudio_dlna.encoders
+
+logger = logging.getLogger('encoder-latency')
+
+SAMPLE_RATE = 44100
+FRAME_SIZE = 4
+CHUNK_DURATION = 0.01
+IMPULSE_TIME = 2.0
+TAIL_TIME = 3.0
+THRESHOLD = 8000
+
+DECODER_COMMAND = [
+    'ffmpeg', '-loglevel', 'panic',
+    '-fflags', 'nobuffer', '-probesize', '32', '-analyzeduration', '0',
+    '-i', 'pipe:',
+    '-f', 's16le', '-ac', '2', '-ar', str(SAMPLE_RATE), 'pipe:',
+]
+
+
+def feed(pipe, impulse_written):
+    chunk_samples = int(SAMPLE_RATE * CHUNK_DURATION)
+    silence = b'\x00' * chunk_samples * FRAME_SIZE
+    impulse = array.array(b'h', [30000, 30000] * 32).tostring()
+    impulse += silence[len(impulse):]
+    chunks = int((IMPULSE_TIME + TAIL_TIME) / CHUNK_DURATION)
+    impulse_chunk = int(IMPULSE_TIME / CHUNK_DURATION)
+
+    start_time = time.time()
+    try:
+        for index in range(chunks):
+            if index == impulse_chunk:
+                impulse_written.append(time.time())
+                pipe.write(impulse)
+            else:
+                pipe.write(silence)
+            delay = start_time + (index + 1) * CHUNK_DURATION - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    except IOError:
+        pass
+    finally:
+        pipe.close()
+
+
+def measure(encoder):
+    enc_process = subprocess.Popen(
+        encoder.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    dec_process = subprocess.Popen(
+        DECODER_COMMAND, stdin=enc_process.stdout, stdout=subprocess.PIPE)
+    enc_process.stdout.close()
+
+    impulse_written = []
+    feeder = threading.Thread(
+        target=feed, args=(enc_process.stdin, impulse_written))
+    feeder.daemon = True
+    feeder.start()
+
+    fd = dec_process.stdout.fileno()
+    position = 0
+    remainder = b''
+    result = None
+    while result is None:
+        data = os.read(fd, 4096)
+        if len(data) == 0:
+            break
+        data = remainder + data
+        size = len(data) - len(data) % 2
+        data, remainder = data[:size], data[size:]
+        samples = array.array(b'h', data)
+        for index, sample in enumerate(samples):
+            if abs(sample) > THRESHOLD:
+                result = (
+                    time.time() - impulse_written[0],
+                    (position + index) // 2 - int(IMPULSE_TIME * SAMPLE_RATE))
+                break
+        position += len(samples)
+
+    for process in [enc_process, dec_process]:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    feeder.join()
+    return result
+
+
+def main(options):
+    level = logging.DEBUG if options['--debug'] else logging.WARNING
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s %(name)-46s %(levelname)-8s %(message)s',
+        datefmt='%m-%d %H:%M:%S')
+
+    backend = options['--backend']
+    try:
+        pulseaudio_dlna.codecs.set_backend(backend)
+    except pulseaudio_dlna.codecs.UnknownBackendException as e:
+        print(e)
+        sys.exit(1)
+
+    for identifier in options['--codecs'].split(','):
+        codec_type = pulseaudio_dlna.codecs.CODECS.get(identifier, None)
+        if codec_type is None:
+            print('Unknown codec "{}"!'.format(identifier))
+            continue
+        for profile in options['--profiles'].split(','):
+            pulseaudio_dlna.encoders.set_latency_profile(profile)
+            encoder = codec_type().encoder
+            type(encoder).AVAILABLE = False
+            if not encoder.binary or not encoder.validate():
+                print('{:<5} {:<10} {} cannot be measured'.format(
+                    identifier, profile, encoder))
+                continue
+            result = measure(encoder)
+            if result is None:
+                print('{:<5} {:<10} impulse not found'.format(
+                    identifier, profile))
+                continue
+            delay, offset = result
+            print('{:<5} {:<10} {:>7.1f} ms delay, {:>6} samples '
+                  'offset'.format(identifier, profile, delay * 1000, offset))
+
+
+if __name__ == '__main__':
+    main(docopt.docopt(__doc__))
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the time from the discovery of a burst of devices until the bridges
+of all of them are registered at the stream server.
+
+A PulseWatcher is started against the running pulseaudio server and the given
+amount of stand-in devices is announced to it. In the serial mode every device
+is announced after the previous one was registered and the devices are not
+batched (the former behaviour). In the burst mode all devices are announced
+at once and their sinks are created as one batch.
+
+Usage:
+    startup-benchmark.py [--devices <devices>] [--runs <runs>] [--debug]
+
+Options:
+    --devices=<devices>            Set the number of devices [default: 10].
+    --runs=<runs>                  Set the number of runs per mode [default: 3].
+    --debug                        Enable debug mode.
+'''
+
+from __future__ import unicode_literals
+
+import docopt
+import logging
+import multiprocessing
+import Queue
+import time
+
+import pulseaudio_dlna.codecs
+import pulseaudio_dlna.plugins.renderer
+import pulseaudio_dlna.pulseaudio
+
+logger = logging.getLogger('startup-benchmark')
+
+TIMEOUT = 30
+
+
+class BenchmarkRenderer(pulseaudio_dlna.plugins.renderer.BaseRenderer):
+
+    def __init__(self, run, index):
+        pulseaudio_dlna.plugins.renderer.BaseRenderer.__init__(
+            self,
+            udn='uuid:startup-benchmark-{}-{}'.format(run, index),
+            flavour='Benchmark',
+            name='Startup Benchmark {} {}'.format(run, index),
+            ip='127.0.0.1',
+            port=0)
+        self.codecs = [pulseaudio_dlna.codecs.WavCodec()]
+
+
+def wait_for_bridges(stream_queue, count):
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        try:
+            message = stream_queue.get(timeout=deadline - time.time())
+        except Queue.Empty:
+            return False
+        if message.get('type', None) == 'update_bridges' and \
+           len(message['bridges']) >= count:
+            return True
+    return False
+
+
+def measure(run, devices, batched):
+    watcher_class = pulseaudio_dlna.pulseaudio.PulseWatcher
+    batch_window = watcher_class.DEVICE_BATCH_WINDOW
+    if not batched:
+        watcher_class.DEVICE_BATCH_WINDOW = 0
+    pulse_queue = multiprocessing.Queue()
+    stream_queue = multiprocessing.Queue()
+    watcher = watcher_class(pulse_queue, stream_queue)
+    process = multiprocessing.Process(target=watcher.run)
+    process.start()
+    watcher_class.DEVICE_BATCH_WINDOW = batch_window
+    # Give the watcher the time to connect to pulseaudio.
+    time.sleep(1)
+
+    try:
+        start_time = time.time()
+        for index in range(devices):
+            pulse_queue.put({
+                'type': 'add_device',
+                'device': BenchmarkRenderer(run, index),
+            })
+            if not batched and not wait_for_bridges(stream_queue, index + 1):
+                return None
+        if batched and not wait_for_bridges(stream_queue, devices):
+            return None
+        return time.time() - start_time
+    finally:
+        # The watcher removes its sinks when it is terminated.
+        process.terminate()
+        process.join()
+
+
+def main(options):
+    level = logging.DEBUG if options['--debug'] else logging.WARNING
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s %(name)-46s %(levelname)-8s %(message)s',
+        datefmt='%m-%d %H:%M:%S')
+
+    devices = int(options['--devices'])
+    runs = int(options['--runs'])
+
+    print('{} devices, {} runs per mode'.format(devices, runs))
+    run = 0
+    for mode, batched in [('serial', False), ('burst', True)]:
+        durations = []
+        for _ in range(runs):
+            duration = measure(run, devices, batched)
+            run += 1
+            if duration is None:
+                logger.error('Not all bridges were registered in time.')
+                continue
+            durations.append(duration)
+        if not durations:
+            continue
+        print('{mode}: min {min:.3f}s, avg {avg:.3f}s, max {max:.3f}s'.format(
+            mode=mode,
+            min=min(durations),
+            avg=sum(durations) / len(durations),
+            max=max(durations)))
+
+
+if __name__ == '__main__':
+    main(docopt.docopt(__doc__))
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This file is part of pulseaudio-dlna.
+
+# pulseaudio-dlna is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pulseaudio-dlna is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pulseaudio-dlna.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the time from a sink update (the moment pulseaudio-dlna instructs
+a device to play) until the first encoded byte is ready for the device,
+with and without a prewarmed pipeline.
+
+Play some audio to the monitored sink while the benchmark is running.
+
+Usage:
+    stream-start-benchmark.py [--codec <codec>] [--monitor <monitor>]
+                              [--play-delay <seconds>] [--runs <runs>]
+                              [--debug]
+
+Options:
+    --codec=<codec>                Set the codec to benchmark [default: mp3].
+    --monitor=<monitor>            Set the monitor source to record from [default: @DEFAULT_MONITOR@].
+    --play-delay=<seconds>         Set the time a device needs to request the stream
+                                   after it was instructed to play [default: 0.5].
+    --runs=<runs>                  Set the number of runs per mode [default: 5].
+    --debug                        Enable debug mode.
+'''
+
+from __future__ import unicode_literals
+
+import docopt
+import logging
+import sys
+import time
+
+import pulseaudio_dlna.codecs
+import pulseaudio_dlna.encoders
+import pulseaudio_dlna.streamserver
+
+logger = logging.getLogger('stream-start-benchmark')
+
+
+def measure(codec, monitor, play_delay, warm):
+    recorder = codec.get_recorder(monitor)
+    encoder = codec.encoder
+    queue = pulseaudio_dlna.streamserver.ProcessQueue(
+        encoder.bytes_per_second)
+
+    start_time = time.time()
+    process_thread = pulseaudio_dlna.streamserver.ProcessThread(
+        monitor, encoder, recorder, codec)
+    process_thread.daemon = True
+    if warm:
+        process_thread.start()
+    time.sleep(play_delay)
+    process_thread.add_queue(queue)
+    if not warm:
+        process_thread.start()
+    queue.get()
+    duration = time.time() - start_time
+
+    process_thread.stop()
+    process_thread.join()
+    return duration
+
+
+def main(options):
+    level = logging.DEBUG if options['--debug'] else logging.WARNING
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s %(name)-46s %(levelname)-8s %(message)s',
+        datefmt='%m-%d %H:%M:%S')
+
+    codec_type = pulseaudio_dlna.codecs.CODECS.get(options['--codec'], None)
+    if codec_type is None:
+        print('Unknown codec "{}"!'.format(options['--codec']))
+        sys.exit(1)
+    codec = codec_type()
+    encoder = codec.encoder
+    if not encoder.validate():
+        print('The encoder "{}" is not available!'.format(encoder))
+        sys.exit(1)
+
+    monitor = options['--monitor']
+    play_delay = float(options['--play-delay'])
+    runs = int(options['--runs'])
+
+    for mode, warm in [('cold', False), ('warm', True)]:
+        durations = [
+            measure(codec, monitor, play_delay, warm) for _ in range(runs)]
+        print('{mode}: min {min:.3f}s, avg {avg:.3f}s, max {max:.3f}s '
+              '(including {delay:.3f}s play delay)'.format(
+                  mode=mode,
+                  min=min(durations),
+                  avg=sum(durations) / len(durations),
+                  max=max(durations),
+                  delay=play_delay))
+
+
+if __name__ == '__main__':
+    main(docopt.docopt(__doc__))